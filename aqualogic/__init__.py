@@ -1,24 +1,23 @@
 """Support for AquaLogic devices."""
-from datetime import timedelta
 import logging
-import threading
-import time
 
 #from aqualogic.core import AquaLogic
-from .core import AquaLogic
+from .aio import AquaLogicManager
+from .core import States
 import voluptuous as vol
 
 from homeassistant.const import (
     CONF_DEVICE,
     CONF_HOST,
+    CONF_NAME,
     CONF_PATH,
     CONF_PORT,
     EVENT_HOMEASSISTANT_START,
     EVENT_HOMEASSISTANT_STOP,
 )
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers import config_validation as cv
-#from homeassistant.helpers.dispatcher import dispatcher_send
+from homeassistant.helpers.dispatcher import async_dispatcher_send
 from homeassistant.helpers.typing import ConfigType
 
 _LOGGER = logging.getLogger(__name__)
@@ -26,16 +25,38 @@ _LOGGER = logging.getLogger(__name__)
 DOMAIN = "aqualogic"
 UPDATE_TOPIC = f"{DOMAIN}_update"
 CONF_UNIT = "unit"
-RECONNECT_INTERVAL = timedelta(seconds=10)
+CONF_PANELS = "panels"
+
+
+def update_topic(key, panel_name=None):
+    """Dispatcher topic for changes to an AquaLogic property name or
+    States member on the given panel."""
+    if isinstance(key, States):
+        key = key.name.lower()
+    if panel_name is not None:
+        return f"{UPDATE_TOPIC}_{panel_name}_{key}"
+    return f"{UPDATE_TOPIC}_{key}"
+
+
+CONNECTION_SCHEMA = {
+    vol.Optional(CONF_DEVICE, default="socket"): cv.string,
+    vol.Optional(CONF_HOST, default="localhost"): cv.string,
+    vol.Optional(CONF_PORT, default=23): cv.port,
+    vol.Optional(CONF_PATH, default="/dev/ttyUSB0"): cv.string,
+}
+
+PANEL_SCHEMA = vol.Schema({vol.Required(CONF_NAME): cv.slug, **CONNECTION_SCHEMA})
 
 CONFIG_SCHEMA = vol.Schema(
     {
         DOMAIN: vol.Schema(
             {
-                vol.Optional(CONF_DEVICE, default="socket"): cv.string,
-                vol.Optional(CONF_HOST, default="localhost"): cv.string,
-                vol.Optional(CONF_PORT, default=23): cv.port,
-                vol.Optional(CONF_PATH, default="/dev/ttyUSB0"): cv.string,
+                **CONNECTION_SCHEMA,
+                # Several panels, each with its own name; replaces the
+                # single connection above
+                vol.Optional(CONF_PANELS): vol.All(
+                    cv.ensure_list, [PANEL_SCHEMA], vol.Length(min=1)
+                ),
             }
         )
     },
@@ -43,77 +64,69 @@ CONFIG_SCHEMA = vol.Schema(
 )
 
 
-def setup(hass: HomeAssistant, config: ConfigType) -> bool:
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     """Set up AquaLogic platform."""
-    device = config[DOMAIN][CONF_DEVICE]
-    host = config[DOMAIN][CONF_HOST]
-    port = config[DOMAIN][CONF_PORT]
-    path = config[DOMAIN][CONF_PATH]
-    processor = AquaLogicProcessor(hass, device, host, port, path)
+    if CONF_PANELS in config[DOMAIN]:
+        panels = config[DOMAIN][CONF_PANELS]
+    else:
+        # A single unnamed panel
+        panels = [{CONF_NAME: None, **config[DOMAIN]}]
+    processor = AquaLogicProcessor(hass, panels)
     hass.data[DOMAIN] = processor
-    hass.bus.listen_once(EVENT_HOMEASSISTANT_START, processor.start_listen)
-    hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP, processor.shutdown)
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, processor.start_listen)
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, processor.shutdown)
     _LOGGER.debug("AquaLogicProcessor initialized")
     return True
 
 
-class AquaLogicProcessor(threading.Thread):
-    """AquaLogic event processor thread."""
+class AquaLogicProcessor:
+    """AquaLogic event processor; runs every configured panel as a task
+    on the event loop."""
 
-    def __init__(self, hass, device, host, port, path):
+    def __init__(self, hass, panels):
         """Initialize the data object."""
-        super().__init__(daemon=True)
         self._hass = hass
-        self._device = device
-        self._host = host
-        self._port = port
-        self._path = path
-        self._shutdown = False
-        self._panel = None
-
+        self._manager = AquaLogicManager(self.data_changed)
+        for panel in panels:
+            if panel[CONF_DEVICE] == "socket":
+                self._manager.add_socket_panel(
+                    panel[CONF_NAME], panel[CONF_HOST], panel[CONF_PORT]
+                )
+            else:
+                self._manager.add_serial_panel(panel[CONF_NAME], panel[CONF_PATH])
+        self._task = None
+
+    @callback
     def start_listen(self, event):
-        """Start event-processing thread."""
-        _LOGGER.debug("Event processing thread started")
-        self.start()
+        """Start event-processing task."""
+        _LOGGER.debug("Event processing task started")
+        self._task = self._hass.async_create_background_task(
+            self._manager.run(), f"{DOMAIN} processor"
+        )
 
+    @callback
     def shutdown(self, event):
         """Signal shutdown of processing event."""
         _LOGGER.debug("Event processing signaled exit")
-        self._shutdown = True
+        self._manager.close()
 
-    def data_changed(self, panel):
+    @callback
+    def data_changed(self, name, panel, changed):
         """Aqualogic data changed callback."""
-        self._hass.helpers.dispatcher.dispatcher_send(UPDATE_TOPIC)
+        for key in changed:
+            async_dispatcher_send(self._hass, update_topic(key, name))
 
-    def run(self):
-        """Event thread."""
-
-        while True:
-            self._panel = AquaLogic()
-            try:
-                if self._device == "socket":
-                    _LOGGER.info("Connecting to %s:%d", self._host, self._port)
-                    self._panel.connect_socket(self._host, self._port)
-                else:
-                    _LOGGER.info("Connecting to %s", self._path)
-                    self._panel.connect_serial(self._path)
-
-                self._panel.process(self.data_changed)
-
-                if self._shutdown:
-                    return
-
-                if self._device == "socket":
-                    _LOGGER.error("Connection to %s:%d lost", self._host, self._port)
-                else:
-                    _LOGGER.error("Connection to %s lost", self._path)
-
-            except Exception as e:
-                _LOGGER.error("Connection exception %s", e)
+    @property
+    def panel_names(self):
+        """Names of the configured panels; None for a single unnamed
+        panel."""
+        return self._manager.names
 
-            time.sleep(RECONNECT_INTERVAL.seconds)
+    def get_panel(self, name):
+        """Retrieve the AquaLogic object for the named panel."""
+        return self._manager.panel(name)
 
     @property
     def panel(self):
-        """Retrieve the AquaLogic object."""
-        return self._panel
+        """Retrieve the AquaLogic object of the first panel."""
+        return self._manager.panel(self.panel_names[0])
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""asyncio interface to a Hayward/Goldline AquaLogic/ProLogic
+pool controller."""
+
+import asyncio
+import logging
+import random
+import time
+
+import serial
+
+from .core import AquaLogic, enable_keepalive
+from .menu import Menu
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _AquaLogicProtocol(asyncio.Protocol):
+    """Forwards transport events to an AsyncAquaLogic."""
+
+    def __init__(self, panel):
+        self._panel = panel
+
+    def connection_made(self, transport):
+        self._panel._connection_made(transport)
+
+    def data_received(self, data):
+        self._panel._data_received(data)
+
+    def connection_lost(self, exc):
+        self._panel._connection_lost(exc)
+
+
+class AsyncAquaLogic(AquaLogic):
+    """Hayward/Goldline AquaLogic/ProLogic pool controller, driven by an
+    asyncio event loop instead of a reader thread."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._transport = None
+        self._watchdog = None
+        self._last_frame_time = None
+        self._listeners = set()
+        self._menu = None
+
+    async def connect_socket(self, host, port):
+        """Connects via a RS-485 to Ethernet adapter."""
+        loop = asyncio.get_running_loop()
+        await loop.create_connection(
+            lambda: _AquaLogicProtocol(self), host, port)
+
+    async def connect_serial(self, serial_port_name):
+        """Connects via a serial port. Requires pyserial-asyncio."""
+        import serial_asyncio  # pylint: disable=import-outside-toplevel
+        loop = asyncio.get_running_loop()
+        await serial_asyncio.create_serial_connection(
+            loop, lambda: _AquaLogicProtocol(self), serial_port_name,
+            baudrate=19200, stopbits=serial.STOPBITS_TWO)
+
+    def close(self):
+        """Closes the connection; pending updates() iterators finish."""
+        if self._transport is not None:
+            self._transport.close()
+
+    @property
+    def menu(self):
+        """Returns the Menu that runs menu macros, such as changing the
+        heater setpoints, on this panel."""
+        if self._menu is None:
+            self._menu = Menu(self)
+        return self._menu
+
+    @property
+    def connected(self):
+        """Returns True while the transport is open."""
+        return self._transport is not None
+
+    async def updates(self):
+        """Yields a frozenset of the changed field names each time any
+        data changes, until the connection is lost or closed."""
+        listener = asyncio.Queue()
+        self._listeners.add(listener)
+        try:
+            while self._transport is not None or not listener.empty():
+                update = await listener.get()
+                if update is None:
+                    return
+                yield update
+        finally:
+            self._listeners.discard(listener)
+
+    def _connection_made(self, transport):
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            enable_keepalive(sock)
+        self._transport = transport
+        self._write = transport.write
+        self._decoder.reset()
+        self._last_frame_time = time.monotonic()
+        self._schedule_watchdog()
+
+    def _data_received(self, data):
+        frame_start_time = time.monotonic()
+        if self._recorder is not None:
+            self._recorder.write(data, frame_start_time)
+        frames = self._decoder.feed(data)
+        for frame_type, frame in frames:
+            self._process_frame(frame_type, frame, frame_start_time,
+                                self._data_changed)
+        if frames:
+            self._last_frame_time = frame_start_time
+
+    def _connection_lost(self, exc):
+        if exc is not None:
+            _LOGGER.info('Connection lost: %s', exc)
+        self._transport = None
+        # Echoes of frames sent on this connection will never arrive
+        self._awaiting_echo.clear()
+        self._last_burst = False
+        self._notify_changes(force=True)
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+            self._watchdog = None
+        for listener in self._listeners:
+            listener.put_nowait(None)
+
+    def _data_changed(self, panel, changed):
+        for listener in self._listeners:
+            listener.put_nowait(changed)
+
+    def _schedule_watchdog(self):
+        loop = asyncio.get_running_loop()
+        self._watchdog = loop.call_later(self.READ_TIMEOUT,
+                                         self._check_timeout)
+
+    def _check_timeout(self):
+        # Same policy as process(): give up if no frame has arrived within
+        # READ_TIMEOUT so the caller can reconnect.
+        if time.monotonic() - self._last_frame_time > self.READ_TIMEOUT:
+            _LOGGER.info('Frame timeout')
+            self._watchdog = None
+            self.close()
+        else:
+            self._schedule_watchdog()
+
+
+class ConnectionHealth():
+    """Connection statistics for one panel managed by AquaLogicManager."""
+
+    def __init__(self):
+        self.connected = False
+        self.connected_since = None
+        self.connects = 0
+        self.disconnects = 0
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.next_attempt = None
+
+    def __repr__(self):
+        return ('ConnectionHealth(connected={}, connects={}, disconnects={}, '
+                'consecutive_failures={}, last_error={!r})'.format(
+                    self.connected, self.connects, self.disconnects,
+                    self.consecutive_failures, self.last_error))
+
+
+class AquaLogicManager():
+    """Runs any number of panels, connected by socket or serial port, as
+    tasks on one event loop, reconnecting each panel when its connection
+    is lost.
+
+    Reconnection is retried immediately once, then with jittered
+    exponential backoff between RECONNECT_MIN_DELAY and
+    RECONNECT_MAX_DELAY seconds; the backoff starts over once a
+    connection has received frames. Each panel object is kept across
+    reconnects, so its last known values and queued commands survive a
+    brief bridge reset.
+
+    data_changed_callback is called as callback(name, panel, changed)
+    whenever data on one of the panels changes."""
+
+    RECONNECT_MIN_DELAY = 1
+    RECONNECT_MAX_DELAY = 60
+
+    def __init__(self, data_changed_callback, **panel_options):
+        """panel_options are passed to each AsyncAquaLogic."""
+        self._data_changed_callback = data_changed_callback
+        self._panel_options = panel_options
+        self._connections = {}
+        self._panels = {}
+        self._health = {}
+        self._tasks = {}
+        self._closed = None
+
+    def add_socket_panel(self, name, host, port):
+        """Adds a panel connected via a RS-485 to Ethernet adapter."""
+        self._add_panel(name, '{}:{}'.format(host, port),
+                        lambda panel: panel.connect_socket(host, port))
+
+    def add_serial_panel(self, name, serial_port_name):
+        """Adds a panel connected via a serial port."""
+        self._add_panel(name, serial_port_name,
+                        lambda panel: panel.connect_serial(serial_port_name))
+
+    def panel(self, name):
+        """Returns the named panel."""
+        return self._panels.get(name)
+
+    def health(self, name):
+        """Returns the ConnectionHealth of the named panel."""
+        return self._health.get(name)
+
+    @property
+    def names(self):
+        """Returns the names of the panels."""
+        return list(self._connections)
+
+    async def run(self):
+        """Runs all panels until close() is called."""
+        self._closed = asyncio.Event()
+        for name in self._connections:
+            self._start(name)
+        await self._closed.wait()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks = {}
+        self._closed = None
+
+    def close(self):
+        """Disconnects all panels and stops run()."""
+        if self._closed is not None:
+            self._closed.set()
+        for task in self._tasks.values():
+            task.cancel()
+        for panel in self._panels.values():
+            panel.close()
+
+    def reconnect_delay(self, failures):
+        """Returns the delay in seconds before the next connection attempt
+        after the given number of consecutive failures."""
+        if failures <= 1:
+            return 0
+        limit = min(self.RECONNECT_MAX_DELAY,
+                    self.RECONNECT_MIN_DELAY * 2 ** (failures - 2))
+        return random.uniform(limit / 2, limit)
+
+    def _add_panel(self, name, description, connect):
+        if name in self._connections:
+            raise ValueError('Duplicate panel name {}'.format(name))
+        self._connections[name] = (description, connect)
+        self._panels[name] = AsyncAquaLogic(**self._panel_options)
+        self._health[name] = ConnectionHealth()
+        if self._closed is not None:
+            # Already running
+            self._start(name)
+
+    def _start(self, name):
+        loop = asyncio.get_running_loop()
+        self._tasks[name] = loop.create_task(self._run_panel(name))
+
+    async def _run_panel(self, name):
+        description, connect = self._connections[name]
+        panel = self._panels[name]
+        health = self._health[name]
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                _LOGGER.info('Connecting to %s', description)
+                await connect(panel)
+                health.connected = True
+                health.connected_since = time.monotonic()
+                health.connects += 1
+                async for changed in panel.updates():
+                    self._data_changed_callback(name, panel, changed)
+                _LOGGER.error('Connection to %s lost', description)
+                health.last_error = 'Connection lost'
+            except Exception as e:  # pylint: disable=broad-except
+                _LOGGER.error('Connection exception %s', e)
+                health.last_error = str(e)
+
+            if health.connected:
+                health.connected = False
+                health.disconnects += 1
+                if panel._last_frame_time > health.connected_since:
+                    # The panel was talking to us; not a failed attempt
+                    health.consecutive_failures = 0
+            health.consecutive_failures += 1
+
+            delay = self.reconnect_delay(health.consecutive_failures)
+            health.next_attempt = loop.time() + delay
+            if delay > 0:
+                _LOGGER.info('Reconnecting to %s in %.1f s', description, delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Recording and replay of raw AquaLogic bus traffic.
+
+A capture file starts with MAGIC, followed by one record per chunk of
+data read from the bus: a little-endian double holding the time in
+seconds since the capture started (from time.monotonic()), a
+little-endian unsigned 32-bit length, and that many bytes of data."""
+
+import struct
+import time
+
+MAGIC = b'AQLCAP01'
+
+_RECORD_HEADER = struct.Struct('<dI')
+
+
+class CaptureError(Exception):
+    """Raised when a file is not a valid capture."""
+
+
+class CaptureWriter():
+    """Writes bus data to a capture file object opened for binary
+    writing."""
+
+    def __init__(self, file):
+        self._file = file
+        self._start_time = time.monotonic()
+        self._file.write(MAGIC)
+
+    def write(self, data, timestamp=None):
+        """Appends a chunk of bus data. timestamp is a time.monotonic()
+        value; it defaults to now."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._file.write(_RECORD_HEADER.pack(timestamp - self._start_time,
+                                             len(data)))
+        self._file.write(data)
+
+    def flush(self):
+        """Flushes the underlying file."""
+        self._file.flush()
+
+
+def read_capture(file):
+    """Yields (timestamp, data) for each chunk in a capture file object
+    opened for binary reading."""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise CaptureError('Not an AquaLogic capture')
+    while True:
+        header = file.read(_RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) != _RECORD_HEADER.size:
+            raise CaptureError('Truncated record header')
+        timestamp, length = _RECORD_HEADER.unpack(header)
+        data = file.read(length)
+        if len(data) != length:
+            raise CaptureError('Truncated record')
+        yield timestamp, data
+
+
+class ReplayIO():
+    """Read-only stream that plays back a capture file, for use with
+    AquaLogic.connect_io().
+
+    By default the chunks are returned as fast as they are read; with
+    realtime=True each chunk is delayed until its recorded time, scaled
+    by speed. Anything written is kept in the written list."""
+
+    def __init__(self, file, realtime=False, speed=1.0):
+        self._file = file
+        self._chunks = read_capture(file)
+        self._realtime = realtime
+        self._speed = speed
+        self._start_time = None
+        self._pending = b''
+        self.written = []
+
+    def read(self, size=-1):
+        """Returns up to size bytes of the next chunk; b'' at the end."""
+        if not self._pending:
+            try:
+                timestamp, self._pending = next(self._chunks)
+            except StopIteration:
+                return b''
+            if self._realtime:
+                self._wait_until(timestamp)
+        if size < 0:
+            size = len(self._pending)
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def write(self, data):
+        """Discards data sent to the bus, keeping a copy in written."""
+        self.written.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        """Does nothing; present for file compatibility."""
+
+    def close(self):
+        """Closes the capture file."""
+        self._file.close()
+
+    def _wait_until(self, timestamp):
+        now = time.monotonic()
+        if self._start_time is None:
+            self._start_time = now - timestamp / self._speed
+        delay = self._start_time + timestamp / self._speed - now
+        if delay > 0:
+            time.sleep(delay)
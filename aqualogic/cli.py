@@ -3,12 +3,14 @@
 import threading
 import logging
 import sys
-from core import AquaLogic, States
+from aqualogic.core import AquaLogic, States
 
 logging.basicConfig(level=logging.INFO)
 
 
-def _data_changed(panel):
+def _data_changed(panel, changed):
+    print('Changed: {}'.format(
+        ', '.join(sorted(getattr(key, 'name', key) for key in changed))))
     print('Pool Temp: {}'.format(panel.pool_temp))
     print('Air Temp: {}'.format(panel.air_temp))
     print('Pump Speed: {}'.format(panel.pump_speed))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Scheduling of commands sent to the AquaLogic bus."""
+
+from collections import deque
+from enum import IntEnum, unique
+import threading
+
+
+@unique
+class Priority(IntEnum):
+    """Order in which queued commands are sent; lower values first"""
+    # Commands a user is waiting on, e.g. a switch being turned on
+    HIGH = 0
+    # Background work, e.g. walking the menus to read settings
+    LOW = 1
+
+
+class CommandQueue():
+    """Commands waiting to be sent, highest priority first and in the
+    order they were queued within a priority.
+
+    Commands are kept as given; the queue never looks inside them. It may
+    be used from several threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = [deque() for _ in Priority]
+
+    def __len__(self):
+        return sum(len(commands) for commands in self._queues)
+
+    def put(self, command, priority=Priority.HIGH, first=False):
+        """Adds a command to the end of its priority's queue, or to the
+        front with first=True."""
+        with self._lock:
+            if first:
+                self._queues[priority].appendleft(command)
+            else:
+                self._queues[priority].append(command)
+
+    def get(self):
+        """Removes and returns the next command, or None if the queue is
+        empty."""
+        with self._lock:
+            for commands in self._queues:
+                if commands:
+                    return commands.popleft()
+        return None
+
+    def remove(self, command):
+        """Removes a command that has not been sent yet. Returns False if
+        it is no longer queued."""
+        with self._lock:
+            for commands in self._queues:
+                for i, queued in enumerate(commands):
+                    if queued is command:
+                        del commands[i]
+                        return True
+        return False
+
+    def clear(self):
+        """Removes all commands."""
+        with self._lock:
+            for commands in self._queues:
+                commands.clear()
@@ -2,15 +2,23 @@
 """A library to interface with a Hayward/Goldline AquaLogic/ProLogic
 pool controller."""
 
-from enum import IntEnum, unique
-from threading import Timer
+from collections import deque
+from enum import Enum, IntEnum, unique
 import binascii
+import heapq
+import itertools
 import logging
-import queue
+import math
 import socket
 import time
 import serial
-import datetime
+
+from .capture import CaptureWriter, ReplayIO
+from .commands import CommandQueue, Priority
+from .display import DisplayParser
+from .energy import EnergyMeter
+from .frame import FrameDecoder, encode_frame
+from .history import FieldHistory
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -82,6 +90,155 @@ class Keys(IntEnum):
     AUX_14 = 0x02000000
 
 
+@unique
+class KeyEventSource(Enum):
+    """Kinds of panel that key events can be sent as; the value is the
+    frame type"""
+    # Local wired panel (black face with service button)
+    LOCAL_WIRED = b'\x00\x02'
+    # Remote wired panel (white face)
+    REMOTE_WIRED = b'\x00\x03'
+    # Wireless remote
+    WIRELESS = b'\x00\x83'
+
+
+def _key_event_frame(source, key):
+    if source == KeyEventSource.WIRELESS:
+        value = key.value.to_bytes(4, byteorder='little')
+        payload = b'\x01' + value + value + b'\x00'
+    else:
+        # Second word is the same as the first on first down
+        value = key.value.to_bytes(2, byteorder='little')
+        payload = value + value
+    return encode_frame(source.value, payload)
+
+
+# Complete bus frames for every key, keyed by source then key. Keys above
+# 0xffff only exist on the wireless remote.
+_KEY_EVENT_FRAMES = {
+    source: {key: _key_event_frame(source, key) for key in Keys
+             if key.value <= 0xffff or source == KeyEventSource.WIRELESS}
+    for source in KeyEventSource}
+
+
+def enable_keepalive(sock, idle=10, interval=5, count=3):
+    """Enables TCP keepalive on a socket so that a dead RS-485 bridge is
+    detected within about idle + interval * count seconds, where the
+    platform allows tuning it."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', idle),
+                          ('TCP_KEEPINTVL', interval),
+                          ('TCP_KEEPCNT', count)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+_STATES_BY_BIT = {state.value: state for state in States}
+
+
+def _states_in_mask(mask):
+    """Returns a frozenset of the States whose bits are set in mask."""
+    states = []
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        state = _STATES_BY_BIT.get(bit)
+        if state is not None:
+            states.append(state)
+    return frozenset(states)
+
+
+# Numeric readings kept by AquaLogic.history()
+HISTORY_FIELDS = frozenset((
+    'air_temp', 'pool_temp', 'spa_temp', 'pool_chlorinator',
+    'spa_chlorinator', 'salt_level', 'pump_speed', 'pump_power'))
+
+
+# Properties whose value is derived from other fields or states; when the
+# key changes, the listed properties are reported as changed too.
+_DERIVED_FIELDS = {
+    'check_system_msg': ('status',),
+    'heater_enabled': ('is_heater_enabled',),
+    'super_chlor_time_remain': ('super_chlorinate_time_remaining',),
+    States.CHECK_SYSTEM: ('check_system_msg', 'status'),
+    States.SUPER_CHLORINATE: ('super_chlorinate_time_remaining',
+                              'is_super_chlorinate_enabled'),
+}
+
+# Fields that change with nearly every frame; they are reported to
+# subscribe() callbacks as soon as they change, but not to the data changed
+# callback, and aren't part of the snapshot.
+_SUBSCRIBE_ONLY_FIELDS = frozenset({'display_text'})
+
+
+class PanelSnapshot():
+    """Read-only copy of the values reported by a panel, taken after the
+    frame that last changed any of them; see AquaLogic.snapshot().
+
+    Attributes have the same meaning as the AquaLogic properties of the
+    same name. Unlike AquaLogic.get_state(), get_state() here ignores
+    state changes that have been requested but not yet reported."""
+
+    # Copied from the AquaLogic attribute with a leading underscore
+    _FIELDS = ('is_metric', 'air_temp', 'pool_temp', 'spa_temp',
+               'pool_chlorinator', 'spa_chlorinator', 'salt_level',
+               'pump_speed', 'pump_power', 'pump_energy_kwh',
+               'pool_heater_setpoint', 'spa_heater_setpoint',
+               'states_mask')
+    __slots__ = _FIELDS + ('time', 'states', '_check_system_msg',
+                           '_heater_enabled', '_super_chlor_time_remain')
+
+    def __init__(self, panel):
+        for name in self._FIELDS:
+            object.__setattr__(self, name, getattr(panel, '_' + name))
+        for name in ('_check_system_msg', '_heater_enabled',
+                     '_super_chlor_time_remain'):
+            object.__setattr__(self, name, getattr(panel, name))
+        object.__setattr__(self, 'time', panel._frame_start_time)
+        object.__setattr__(self, 'states', panel._enabled_states)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PanelSnapshot is read-only')
+
+    def __delattr__(self, name):
+        raise AttributeError('PanelSnapshot is read-only')
+
+    def get_state(self, state):
+        """Returns True if the specified state is enabled."""
+        return (state.value & self.states_mask) != 0
+
+    @property
+    def check_system_msg(self):
+        """Returns the 'Check System' message, or None."""
+        if self.get_state(States.CHECK_SYSTEM):
+            return self._check_system_msg
+        return None
+
+    @property
+    def status(self):
+        """Returns 'OK' or the 'Check System' message."""
+        if self.get_state(States.CHECK_SYSTEM):
+            return self._check_system_msg
+        return 'OK'
+
+    @property
+    def is_heater_enabled(self):
+        """Returns True if gas heater is Auto, else False"""
+        return self._heater_enabled
+
+    @property
+    def super_chlorinate_time_remaining(self):
+        """Returns time remaining if super chlorinate is on"""
+        if self.get_state(States.SUPER_CHLORINATE):
+            return self._super_chlor_time_remain
+        return '00:00'
+
+    @property
+    def is_super_chlorinate_enabled(self):
+        """Returns True if super chlorinate is on"""
+        return self.get_state(States.SUPER_CHLORINATE)
+
+
 class AquaLogic():
     """Hayward/Goldline AquaLogic/ProLogic pool controller."""
 
@@ -91,6 +248,21 @@ class AquaLogic():
     FRAME_ETX = 0x03
 
     READ_TIMEOUT = 5
+    # Time allowed for a state change to show up in the LEDs after its key
+    # has been sent; it can take a while for the state to change.
+    STATE_CHECK_DELAY = 2.0
+    # Maximum number of bytes pulled from the transport per read
+    READ_SIZE = 4096
+    # Assumed time between keep-alives until it has been measured; one
+    # queued command is sent per keep-alive.
+    KEEP_ALIVE_INTERVAL = 0.1
+    # Time on the wire per byte at 19200 baud, 8 data bits, 2 stop bits
+    BYTE_TIME = 11 / 19200
+    # Share of the keep-alive interval that a burst of frames may take,
+    # leaving the rest for the panel's own frames
+    BURST_WINDOW = 0.5
+    # Times a key with no echo is sent again when check_echo is set
+    ECHO_RETRIES = 3
 
     # Local wired panel (black face with service button)
     FRAME_TYPE_LOCAL_WIRED_KEY_EVENT = b'\x00\x02'
@@ -107,9 +279,26 @@ class AquaLogic():
     FRAME_TYPE_PUMP_SPEED_REQUEST = b'\x0c\x01'
     FRAME_TYPE_PUMP_STATUS = b'\x00\x0c'
 
-    def __init__(self):
+    def __init__(self, notify_interval=0,
+                 key_event_source=KeyEventSource.LOCAL_WIRED,
+                 max_burst=1, check_echo=False, history=True):
+        """notify_interval is the minimum time in seconds between data
+        changed callbacks; changes in between are combined into one
+        callback. By default there is one callback per changed frame.
+        key_event_source is the kind of panel that keys are sent as.
+
+        Up to max_burst queued frames are sent after each keep-alive, as
+        long as they fit in BURST_WINDOW of the keep-alive interval. Set
+        check_echo if the adapter hears its own transmissions; frames
+        that are not echoed back before the next keep-alive are treated
+        as collisions, which shrinks the burst.
+
+        With history, the readings listed in HISTORY_FIELDS are kept in
+        memory for history()."""
         self._socket = None
         self._serial = None
+        self._io = None
+        self._recorder = None
         self._is_metric = False
         self._air_temp = None
         self._pool_temp = None
@@ -118,60 +307,182 @@ class AquaLogic():
         self._spa_chlorinator = None
         self._salt_level = None
         self._check_system_msg = None
+        self._display_text = None
+        self._pool_heater_setpoint = None
+        self._spa_heater_setpoint = None
         self._pump_speed = None
         self._pump_power = None
+        self._pump_energy = EnergyMeter()
+        self._pump_energy_kwh = None
         self._states = 0
         self._flashing_states = 0
-        self._send_queue = queue.Queue()
+        # _states plus FILTER_LOW_SPEED, and the States it contains
+        self._states_mask = 0
+        self._enabled_states = frozenset()
+        self._send_queue = CommandQueue()
+        self._keep_alive_interval = self.KEEP_ALIVE_INTERVAL
+        self._last_keep_alive_time = None
+        self._max_burst = max_burst
+        self._burst_limit = max_burst if not check_echo else 1
+        self._check_echo = check_echo
+        # Requests sent in the current keep-alive window whose echo
+        # hasn't been seen yet
+        self._awaiting_echo = deque()
+        self._last_burst = False
+        self.collisions = 0
+        # Desired state for each States member with a change request that
+        # is queued, or sent but not yet verified.
+        self._pending_states = {}
+        # Heap of (deadline, sequence, request) for sent state changes
+        # waiting to be verified; only touched from the reader.
+        self._state_checks = []
+        self._state_check_sequence = itertools.count()
+        self._decoder = FrameDecoder()
+        self._display_parser = DisplayParser()
         # MOD BEGIN
         self._multi_speed_pump = True
         self._heater_enabled = False
         self._super_chlor_time_remain = '00:00'
         # MOD END
         self._heater_auto_mode = True  # Assume the heater is in auto mode
+        self._frame_start_time = None
+        self._data_changed_callback = None
+        self._notify_interval = notify_interval
+        self._last_notify_time = float('-inf')
+        self._changed = set()
+        self._subscribers = {}
+        self._history = {} if history else None
+        self._key_event_frames = _KEY_EVENT_FRAMES[key_event_source]
+        self._key_event_source = key_event_source
+        # Replaced, never modified, after each frame that changes a value
+        self._snapshot = PanelSnapshot(self)
+        self._snapshot_stale = False
+
+        # Frame handlers, keyed by the frame type as an int
+        self._frame_handlers = {}
+        self._unknown_frame_handler = self._on_unknown_frame
+        for frame_type, handler in (
+                (self.FRAME_TYPE_KEEP_ALIVE, self._on_keep_alive),
+                (self.FRAME_TYPE_LEDS, self._on_leds),
+                (self.FRAME_TYPE_DISPLAY_UPDATE, self._on_display_update),
+                (self.FRAME_TYPE_PUMP_STATUS, self._on_pump_status),
+                (self.FRAME_TYPE_PUMP_SPEED_REQUEST,
+                 self._on_pump_speed_request),
+                (self.FRAME_TYPE_LONG_DISPLAY_UPDATE,
+                 self._on_long_display_update),
+                (self.FRAME_TYPE_LOCAL_WIRED_KEY_EVENT, self._on_key_event),
+                (self.FRAME_TYPE_REMOTE_WIRED_KEY_EVENT, self._on_key_event),
+                (self.FRAME_TYPE_WIRELESS_KEY_EVENT, self._on_key_event)):
+            self.register_frame_handler(frame_type, handler)
 
     def connect(self, host, port):
         self.connect_socket(host, port)
 
     def connect_socket(self, host, port):
         """Connects via a RS-485 to Ethernet adapter."""
+        self.close()
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        enable_keepalive(self._socket)
         self._socket.connect((host, port))
         self._socket.settimeout(self.READ_TIMEOUT)
-        self._read = self._read_byte_from_socket
+        self._read = self._read_from_socket
         self._write = self._write_to_socket
 
     def connect_serial(self, serial_port_name):
+        self.close()
         self._serial = serial.Serial(port=serial_port_name, baudrate=19200,
                           stopbits=serial.STOPBITS_TWO, timeout=self.READ_TIMEOUT)
-        self._read = self._read_byte_from_serial
+        self._read = self._read_from_serial
         self._write = self._write_to_serial
 
+    def connect_io(self, io):
+        """Connects to a file-like object carrying raw bus data, e.g. a
+        file captured from the bus."""
+        self.close()
+        self._io = io
+        self._read = self._read_from_io
+        self._write = self._write_to_io
+
+    def close(self):
+        """Closes the connection. The last known values and any queued
+        commands are kept, so the same object can be connected again."""
+        for connection in (self._socket, self._serial, self._io):
+            if connection is not None:
+                connection.close()
+        self._socket = None
+        self._serial = None
+        self._io = None
+        self._decoder.reset()
+        self._awaiting_echo.clear()
+        self._last_burst = False
+
+    def connect_replay(self, path, realtime=False, speed=1.0):
+        """Connects to a capture file written by record(). With realtime
+        the data is delivered at its recorded rate, scaled by speed;
+        otherwise as fast as possible."""
+        # pylint: disable=consider-using-with
+        self.connect_io(ReplayIO(open(path, 'rb'), realtime, speed))
+
+    def record(self, file):
+        """Tees all data subsequently read from the bus to a capture file
+        object opened for binary writing; see aqualogic.capture."""
+        self._recorder = CaptureWriter(file)
+
+    def stop_recording(self):
+        """Stops recording and flushes the capture file."""
+        if self._recorder is not None:
+            self._recorder.flush()
+            self._recorder = None
+
     def _check_state(self, data):
-        desired_states = data['desired_states']
+        # Leave out states a newer request has taken over, e.g. turning
+        # the lights back off after this request turned them on.
+        desired_states = [
+            desired_state for desired_state in data['desired_states']
+            if self._pending_states.get(desired_state['state']) is
+            desired_state]
+        if not desired_states:
+            _LOGGER.debug('state change superseded')
+            return
         for desired_state in desired_states:
-            if (self.get_state(desired_state['state']) !=
+            if (self._get_actual_state(desired_state['state']) !=
                     desired_state['enabled']):
                 # The state hasn't changed
                 data['retries'] -= 1
                 if data['retries'] != 0:
                     # Re-queue the request
                     _LOGGER.info('requeue')
-                    self._send_queue.put(data)
+                    self._send_queue.put(data, data['priority'])
                     return
-            else:
-                _LOGGER.debug('state change successful')
+                _LOGGER.warning('Failed to change %s',
+                                desired_state['state'].name)
+                break
+        else:
+            _LOGGER.debug('state change successful')
 
-    def _read_byte_from_socket(self):
-        data = self._socket.recv(1)
-        return data[0]
-    
-    def _read_byte_from_serial(self):
-        data = self._serial.read(1)
+        # The request has been verified or abandoned
+        for desired_state in desired_states:
+            state = desired_state['state']
+            if self._pending_states.get(state) is desired_state:
+                del self._pending_states[state]
+
+    def _read_from_socket(self):
+        return self._socket.recv(self.READ_SIZE)
+
+    def _read_from_serial(self):
+        # Block for at least one byte, then take whatever else has arrived.
+        data = self._serial.read(max(1, self._serial.in_waiting))
         if len(data) == 0:
             raise serial.SerialTimeoutException()
-        return data[0]
-        
+        return data
+
+    def _read_from_io(self):
+        return self._io.read(self.READ_SIZE)
+
+    def _write_to_io(self, data):
+        self._io.write(data)
+        self._io.flush()
+
     def _write_to_socket(self, data):
         self._socket.send(data)
     
@@ -182,294 +493,341 @@ class AquaLogic():
         # MOD END
         self._serial.flush()
         
-    def _send_frame(self):
-        if not self._send_queue.empty():
-            data = self._send_queue.get(block=False)
-            self._write(data['frame'])
-            _LOGGER.info('%3.3f: Sent: %s', time.monotonic(),
-                         binascii.hexlify(data['frame']))
+    def _send_frames(self):
+        """Sends as many queued frames as fit in this keep-alive window."""
+        budget = self._keep_alive_interval * self.BURST_WINDOW
+        for i in range(self._burst_limit):
+            data = self._send_queue.get()
+            if data is None:
+                break
+            send_time = len(data['frame']) * self.BYTE_TIME
+            if i > 0 and send_time > budget:
+                self._send_queue.put(data, data['priority'], first=True)
+                break
+            budget -= send_time
+            self._send_frame(data)
+
+    def _send_frame(self, data):
+        self._write(data['frame'])
+        _LOGGER.info('%3.3f: Sent: %s', time.monotonic(),
+                     binascii.hexlify(data['frame']))
+        if self._check_echo:
+            self._awaiting_echo.append(data)
+
+        if data.get('desired_states') is not None:
+            # Schedule a check that the state changed
+            heapq.heappush(self._state_checks, (
+                time.monotonic() + self.STATE_CHECK_DELAY,
+                next(self._state_check_sequence), data))
+
+    def _check_echoes(self):
+        """Adjusts the burst size for the last keep-alive window, and
+        resends keys whose echo didn't arrive."""
+        if not self._awaiting_echo:
+            # Everything got through; try a larger burst
+            self._burst_limit = min(self._burst_limit + 1, self._max_burst)
+            return
+        self.collisions += 1
+        self._burst_limit = max(self._burst_limit // 2, 1)
+        _LOGGER.info('%3.3f: No echo for %d frames',
+                     self._frame_start_time, len(self._awaiting_echo))
+        # Resend in the original order; state changes are resent by
+        # their verification instead.
+        while self._awaiting_echo:
+            data = self._awaiting_echo.pop()
+            if data.get('desired_states') is not None:
+                continue
+            data['echo_retries'] = data.get('echo_retries', 0) + 1
+            if data['echo_retries'] <= self.ECHO_RETRIES:
+                self._send_queue.put(data, data['priority'], first=True)
+            else:
+                _LOGGER.warning('Failed to send %s',
+                                binascii.hexlify(data['frame']))
 
-            try:
-                if data['desired_states'] is not None:
-                    # Set a timer to verify the state changes
-                    # Wait 2 seconds as it can take a while for
-                    # the state to change.
-                    Timer(2.0, self._check_state, [data]).start()
-            except KeyError:
-                pass
+    def _run_state_checks(self):
+        """Verifies the state changes whose check is due."""
+        now = time.monotonic()
+        while self._state_checks and self._state_checks[0][0] <= now:
+            _, _, data = heapq.heappop(self._state_checks)
+            self._check_state(data)
 
     def process(self, data_changed_callback):
         """Process data; returns when the reader signals EOF.
-        Callback is notified when any data changes."""
-        # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+        Callback is called as callback(panel, changed=names) when any data
+        changes, where names is a frozenset of the changed field names."""
         try:
+            # The transport's own timeout covers a silent bus; this covers
+            # a bus carrying only noise.
+            deadline = time.monotonic() + self.READ_TIMEOUT
             while True:
-                # Data framing (from the AQ-CO-SERIAL manual):
-                #
-                # Each frame begins with a DLE (10H) and STX (02H) character start
-                # sequence, followed by a 2 to 61 byte long Command/Data field, a
-                # 2-byte Checksum and a DLE (10H) and ETX (03H) character end
-                # sequence.
-                #
-                # The DLE, STX and Command/Data fields are added together to
-                # provide the 2-byte Checksum. If any of the bytes of the
-                # Command/Data Field or Checksum are equal to the DLE character
-                # (10H), a NULL character (00H) is inserted into the transmitted
-                # data stream immediately after that byte. That NULL character
-                # must then be removed by the receiver.
-
-                byte = self._read()
-                frame_start_time = None
-
-                frame_rx_time = datetime.datetime.now()
-
-                while True:
-                    # Search for FRAME_DLE + FRAME_STX
-                    if byte == self.FRAME_DLE:
-                        frame_start_time = time.monotonic()
-                        next_byte = self._read()
-                        if next_byte == self.FRAME_STX:
-                            break
-                        else:
-                            continue
-                    byte = self._read()
-                    elapsed = datetime.datetime.now() - frame_rx_time
-                    if elapsed.seconds > self.READ_TIMEOUT:
-                        _LOGGER.info('Frame timeout')
-                        return
-
-                frame = bytearray()
-                byte = self._read()
-
-                while True:
-                    if byte == self.FRAME_DLE:
-                        # Should be FRAME_ETX or 0 according to
-                        # the AQ-CO-SERIAL manual
-                        next_byte = self._read()
-                        if next_byte == self.FRAME_ETX:
-                            break
-                        elif next_byte != 0:
-                            # Error?
-                            pass
-
-                    frame.append(byte)
-                    byte = self._read()
-
-                # Verify CRC
-                frame_crc = int.from_bytes(frame[-2:], byteorder='big')
-                frame = frame[:-2]
-
-                calculated_crc = self.FRAME_DLE + self.FRAME_STX
-                for byte in frame:
-                    calculated_crc += byte
-
-                if frame_crc != calculated_crc:
-                    _LOGGER.warning('Bad CRC')
-                    continue
-
-                frame_type = frame[0:2]
-                frame = frame[2:]
-
-                if frame_type == self.FRAME_TYPE_KEEP_ALIVE:
-                    # Keep alive
-                    # _LOGGER.debug('%3.3f: KA', frame_start_time)
-
-                    # If a frame has been queued for transmit, send it.
-                    if not self._send_queue.empty():
-                        self._send_frame()
-
-                    continue
-                elif frame_type == self.FRAME_TYPE_LOCAL_WIRED_KEY_EVENT:
-                    _LOGGER.debug('%3.3f: Local Wired Key: %s',
-                                  frame_start_time, binascii.hexlify(frame))
-                elif frame_type == self.FRAME_TYPE_REMOTE_WIRED_KEY_EVENT:
-                    _LOGGER.debug('%3.3f: Remote Wired Key: %s',
-                                  frame_start_time, binascii.hexlify(frame))
-                elif frame_type == self.FRAME_TYPE_WIRELESS_KEY_EVENT:
-                    _LOGGER.debug('%3.3f: Wireless Key: %s',
-                                  frame_start_time, binascii.hexlify(frame))
-                elif frame_type == self.FRAME_TYPE_LEDS:
-                    # _LOGGER.debug('%3.3f: LEDs: %s',
-                    #              frame_start_time, binascii.hexlify(frame))
-                    # First 4 bytes are the LEDs that are on;
-                    # second 4 bytes_ are the LEDs that are flashing
-                    states = int.from_bytes(frame[0:4], byteorder='little')
-                    flashing_states = int.from_bytes(frame[4:8],
-                                                     byteorder='little')
-                    states |= flashing_states
-                    if self._heater_auto_mode:
-                        states |= States.HEATER_AUTO_MODE
-                    if (states != self._states or
-                            flashing_states != self._flashing_states):
-                        self._states = states
-                        self._flashing_states = flashing_states
-                        data_changed_callback(self)
-                elif frame_type == self.FRAME_TYPE_PUMP_SPEED_REQUEST:
-                    value = int.from_bytes(frame[0:2], byteorder='big')
-                    _LOGGER.debug('%3.3f: Pump speed request: %d%%',
-                                  frame_start_time, value)
-                    if self._pump_speed != value:
-                        self._pump_speed = value
-                        data_changed_callback(self)
-                elif ((frame_type == self.FRAME_TYPE_PUMP_STATUS) and
-                      (len(frame) >= 5)):
-                    # Pump status messages sent out by Hayward VSP pumps
-                    self._multi_speed_pump = True
-                    speed = frame[2]
-                    # Power is in BCD
-                    power = ((((frame[3] & 0xf0) >> 4) * 1000) +
-                             (((frame[3] & 0x0f)) * 100) +
-                             (((frame[4] & 0xf0) >> 4) * 10) +
-                             (((frame[4] & 0x0f))))
-                    _LOGGER.debug('%3.3f; Pump speed: %d%%, power: %d watts',
-                                  frame_start_time, speed, power)
-                    if self._pump_power != power:
-                        self._pump_power = power
-                        data_changed_callback(self)
-                elif frame_type == self.FRAME_TYPE_DISPLAY_UPDATE:
-                    parts = frame.decode('latin-1').split()
-                    _LOGGER.debug('%3.3f: Display update: %s',
-                                  frame_start_time, parts)
-
-                    try:
-                        if parts[0] == 'Pool' and parts[1] == 'Temp':
-                            # Pool Temp <temp>°[C|F]
-                            value = int(parts[2][:-2])
-                            if self._pool_temp != value:
-                                self._pool_temp = value
-                                self._is_metric = parts[2][-1:] == 'C'
-                                data_changed_callback(self)
-                        elif parts[0] == 'Spa' and parts[1] == 'Temp':
-                            # Spa Temp <temp>°[C|F]
-                            value = int(parts[2][:-2])
-                            if self._spa_temp != value:
-                                self._spa_temp = value
-                                self._is_metric = parts[2][-1:] == 'C'
-                                data_changed_callback(self)
-                        elif parts[0] == 'Air' and parts[1] == 'Temp':
-                            # Air Temp <temp>°[C|F]
-                            value = int(parts[2][:-2])
-                            if self._air_temp != value:
-                                self._air_temp = value
-                                self._is_metric = parts[2][-1:] == 'C'
-                                data_changed_callback(self)
-                        elif parts[0] == 'Pool' and parts[1] == 'Chlorinator':
-                            # Pool Chlorinator <value>%
-                            value = int(parts[2][:-1])
-                            if self._pool_chlorinator != value:
-                                self._pool_chlorinator = value
-                                data_changed_callback(self)
-                        elif parts[0] == 'Spa' and parts[1] == 'Chlorinator':
-                            # Spa Chlorinator <value>%
-                            value = int(parts[2][:-1])
-                            if self._spa_chlorinator != value:
-                                self._spa_chlorinator = value
-                                data_changed_callback(self)
-                        elif parts[0] == 'Salt' and parts[1] == 'Level':
-                            # Salt Level <value> [g/L|PPM|
-                            value = float(parts[2])
-                            if self._salt_level != value:
-                                self._salt_level = value
-                                self._is_metric = parts[3] == 'g/L'
-                                data_changed_callback(self)
-                        elif parts[0] == 'Check' and parts[1] == 'System':
-                            # Check System <msg>
-                            value = ' '.join(parts[2:])
-                            if self._check_system_msg != value:
-                                self._check_system_msg = value
-                                data_changed_callback(self)
-                        # MOD BEGIN
-                        elif (parts[0] == 'Chlorinator' and parts[1] == 'Off' and 
-                            parts[2] == 'No' and parts[3] == 'Flow'):
-                            # Possible pressure issue
-                            value = ' '.join(parts[2:])
-                            if self._check_system_msg != value:
-                                self._check_system_msg = value
-                                data_changed_callback(self)
-                        elif parts[0] == 'Gas' and parts[1] == 'Heater':
-                            # Gas Heater [Auto|Manual]
-                            if parts[2] == 'Auto' and parts[3] == 'Control':
-                                value = True
-                            elif parts[2] == 'Manual' and parts[3] == 'Off':
-                                value = False
-                            if self._heater_auto_mode != value:
-                                self._heater_auto_mode = value
-                            if self._heater_enabled != value:
-                                self._heater_enabled = value
-                                data_changed_callback(self)
-                        elif (parts[0] == 'Super' and parts[1] == 'Chlorinate' and
-                            parts[3] == 'remaining'):
-                            # Super chlorination <value> remaining
-                            value = parts[2].replace(" ","")
-                            value = value.replace("º",":")
-                            if self._super_chlor_time_remain != value:
-                                self._super_chlor_time_remain = value
-                                data_changed_callback(self)
-                        # MOD END
-                        elif parts[0] == 'Heater1':
-                            self._heater_auto_mode = parts[1] == 'Auto'
-                    except (ValueError, IndexError):
-                        pass
-                elif frame_type == self.FRAME_TYPE_LONG_DISPLAY_UPDATE:
-                    # Not currently parsed
-                    pass
-                else:
-                    _LOGGER.info('%3.3f: Unknown frame: %s %s',
-                                 frame_start_time,
-                                 binascii.hexlify(frame_type),
-                                 binascii.hexlify(frame))
+                data = self._read()
+                if not data:
+                    _LOGGER.info('EOF')
+                    return
+                frame_start_time = time.monotonic()
+                if self._recorder is not None:
+                    self._recorder.write(data, frame_start_time)
+
+                frames = self._decoder.feed(data)
+                for frame_type, frame in frames:
+                    self._process_frame(frame_type, frame, frame_start_time,
+                                        data_changed_callback)
+
+                if frames:
+                    deadline = frame_start_time + self.READ_TIMEOUT
+                elif frame_start_time > deadline:
+                    _LOGGER.info('Frame timeout')
+                    return
         except socket.timeout:
             _LOGGER.info("socket timeout")
         except serial.SerialTimeoutException:
             _LOGGER.info("serial timeout")
-
-    def _append_data(self, frame, data):
-        for byte in data:
-            frame.append(byte)
-            if byte == self.FRAME_DLE:
-                frame.append(0)
-
-    def _get_key_event_frame(self, key):
-        frame = bytearray()
-        frame.append(self.FRAME_DLE)
-        frame.append(self.FRAME_STX)
-
-        if key.value > 0xffff:
-            self._append_data(frame, self.FRAME_TYPE_WIRELESS_KEY_EVENT)
-            self._append_data(frame, b'\x01')
-            self._append_data(frame, key.value.to_bytes(4, byteorder='little'))
-            self._append_data(frame, key.value.to_bytes(4, byteorder='little'))
-            self._append_data(frame, b'\x00')
+        finally:
+            self._notify_changes(force=True)
+
+    def register_frame_handler(self, frame_type, handler):
+        """Registers handler(frame_type, frame) to be called for each
+        received frame of the given type, replacing any existing handler.
+        frame_type may be one of the FRAME_TYPE_ constants or the
+        equivalent int; None sets the handler for unknown frame types."""
+        if frame_type is None:
+            self._unknown_frame_handler = handler
+            return
+        if not isinstance(frame_type, int):
+            frame_type = int.from_bytes(frame_type, byteorder='big')
+        self._frame_handlers[frame_type] = handler
+
+    def _process_frame(self, frame_type, frame, frame_start_time,
+                       data_changed_callback):
+        self._frame_start_time = frame_start_time
+        self._data_changed_callback = data_changed_callback
+        handler = self._frame_handlers.get(
+            int.from_bytes(frame_type, byteorder='big'),
+            self._unknown_frame_handler)
+        handler(frame_type, frame)
+        if self._snapshot_stale:
+            self._snapshot_stale = False
+            self._snapshot = PanelSnapshot(self)
+        if self._changed:
+            self._notify_changes()
+
+    def _notify_changes(self, force=False):
+        """Calls the data changed callback with the fields changed since
+        the last call, subject to the notify interval."""
+        if not self._changed:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_notify_time < self._notify_interval:
+            return
+        self._last_notify_time = now
+        for key in list(self._changed):
+            self._changed.update(_DERIVED_FIELDS.get(key, ()))
+        changed = frozenset(self._changed)
+        self._changed.clear()
+        self._data_changed_callback(self, changed=changed)
+        for key in changed:
+            for callback in list(self._subscribers.get(key, ())):
+                callback(self)
+
+    def subscribe(self, key, callback):
+        """Calls callback(panel) whenever the given property name or States
+        member changes. Returns a function that removes the subscription."""
+        callbacks = self._subscribers.setdefault(key, [])
+        callbacks.append(callback)
+
+        def unsubscribe():
+            callbacks.remove(callback)
+        return unsubscribe
+
+    def _update(self, field, value):
+        """Sets a field, recording it as changed if the value differs."""
+        if (self._history is not None and field in HISTORY_FIELDS and
+                value is not None):
+            history = self._history.get(field)
+            if history is None:
+                history = self._history[field] = FieldHistory()
+            history.add(time.time(), value)
+        attr = '_' + field
+        if getattr(self, attr) != value:
+            setattr(self, attr, value)
+            if field in _SUBSCRIBE_ONLY_FIELDS:
+                for callback in list(self._subscribers.get(field, ())):
+                    callback(self)
+                return
+            self._changed.add(field)
+            self._snapshot_stale = True
+
+    def _on_keep_alive(self, frame_type, frame):
+        # _LOGGER.debug('%3.3f: KA', self._frame_start_time)
+
+        if self._last_keep_alive_time is not None:
+            interval = self._frame_start_time - self._last_keep_alive_time
+            # Skip keep-alives read together, and gaps in the connection
+            if 0 < interval < self.READ_TIMEOUT:
+                self._keep_alive_interval += (
+                    interval - self._keep_alive_interval) / 8
+        self._last_keep_alive_time = self._frame_start_time
+
+        if self._state_checks:
+            self._run_state_checks()
+
+        if self._check_echo and self._last_burst:
+            self._last_burst = False
+            self._check_echoes()
+
+        # If frames have been queued for transmit, send them.
+        if self._send_queue:
+            self._send_frames()
+            self._last_burst = True
+
+    def _on_key_event(self, frame_type, frame):
+        if self._awaiting_echo:
+            sent = encode_frame(frame_type, frame)
+            for data in self._awaiting_echo:
+                if data['frame'] == sent:
+                    # Our own frame, heard back from the bus
+                    self._awaiting_echo.remove(data)
+                    return
+        if frame_type == self.FRAME_TYPE_LOCAL_WIRED_KEY_EVENT:
+            source = 'Local Wired'
+        elif frame_type == self.FRAME_TYPE_REMOTE_WIRED_KEY_EVENT:
+            source = 'Remote Wired'
         else:
-            # MOD BEGIN (this is where it starts breaking)
-            self._append_data(frame, self.FRAME_TYPE_LOCAL_WIRED_KEY_EVENT)
-            # self._append_data(frame, self.FRAME_TYPE_REMOTE_WIRED_KEY_EVENT)
-            self._append_data(frame, key.value.to_bytes(2, byteorder='little'))
-            # self._append_data(frame, b'\x00')
-            # self._append_data(frame, b'\x00')
-            self._append_data(frame, key.value.to_bytes(2, byteorder='little'))
-            # self._append_data(frame, b'\x00')
-            # self._append_data(frame, b'\x00')
-            # MOD END   
-
-        crc = 0
-        for byte in frame:
-            crc += byte
-        self._append_data(frame, crc.to_bytes(2, byteorder='big'))
-
-        frame.append(self.FRAME_DLE)
-        frame.append(self.FRAME_ETX)
+            source = 'Wireless'
+        _LOGGER.debug('%3.3f: %s Key: %s',
+                      self._frame_start_time, source, binascii.hexlify(frame))
+
+    def _on_leds(self, frame_type, frame):
+        # _LOGGER.debug('%3.3f: LEDs: %s',
+        #              self._frame_start_time, binascii.hexlify(frame))
+        # First 4 bytes are the LEDs that are on;
+        # second 4 bytes_ are the LEDs that are flashing
+        states = int.from_bytes(frame[0:4], byteorder='little')
+        flashing_states = int.from_bytes(frame[4:8], byteorder='little')
+        states |= flashing_states
+        if self._heater_auto_mode:
+            states |= States.HEATER_AUTO_MODE
+        if (states != self._states or
+                flashing_states != self._flashing_states):
+            old_mask = self._states_mask
+            self._states = states
+            self._flashing_states = flashing_states
+            # FILTER_LOW_SPEED is reported by a flashing FILTER LED
+            mask = states & ~States.FILTER_LOW_SPEED
+            if flashing_states & States.FILTER:
+                mask |= States.FILTER_LOW_SPEED
+            self._states_mask = mask
+            self._enabled_states = _states_in_mask(mask)
+            self._changed.update(self.changed_states(old_mask))
+            self._changed.add('states')
+            self._snapshot_stale = True
+
+    def _on_pump_speed_request(self, frame_type, frame):
+        value = int.from_bytes(frame[0:2], byteorder='big')
+        _LOGGER.debug('%3.3f: Pump speed request: %d%%',
+                      self._frame_start_time, value)
+        self._update('pump_speed', value)
+
+    def _on_pump_status(self, frame_type, frame):
+        if len(frame) < 5:
+            self._on_unknown_frame(frame_type, frame)
+            return
+        # Pump status messages sent out by Hayward VSP pumps
+        self._multi_speed_pump = True
+        speed = frame[2]
+        # Power is in BCD
+        power = ((((frame[3] & 0xf0) >> 4) * 1000) +
+                 (((frame[3] & 0x0f)) * 100) +
+                 (((frame[4] & 0xf0) >> 4) * 10) +
+                 (((frame[4] & 0x0f))))
+        _LOGGER.debug('%3.3f; Pump speed: %d%%, power: %d watts',
+                      self._frame_start_time, speed, power)
+        self._update('pump_power', power)
+        self._pump_energy.add(self._frame_start_time, power, speed)
+        self._update('pump_energy_kwh',
+                     round(self._pump_energy.day_wh() / 1000, 3))
+
+    def _on_display_update(self, frame_type, frame):
+        for field, value in self._display_parser.parse(frame):
+            self._update(field, value)
+
+    def _on_long_display_update(self, frame_type, frame):
+        # Treated as display text; the extractors only look at the words
+        # shown, so the layout doesn't matter.
+        for field, value in self._display_parser.parse(frame):
+            self._update(field, value)
+
+    def _on_unknown_frame(self, frame_type, frame):
+        _LOGGER.info('%3.3f: Unknown frame: %s %s',
+                     self._frame_start_time,
+                     binascii.hexlify(frame_type),
+                     binascii.hexlify(frame))
 
+    def _get_key_event_frame(self, key):
+        frame = self._key_event_frames.get(key)
+        if frame is None:
+            # Only the wireless remote has this key
+            frame = _KEY_EVENT_FRAMES[KeyEventSource.WIRELESS][key]
         return frame
 
-    def send_key(self, key):
-        """Sends a key."""
+    @property
+    def key_event_source(self):
+        """Returns the KeyEventSource that keys are sent as."""
+        return self._key_event_source
+
+    @key_event_source.setter
+    def key_event_source(self, source):
+        self._key_event_frames = _KEY_EVENT_FRAMES[source]
+        self._key_event_source = source
+
+    def send_key(self, key, priority=Priority.HIGH):
+        """Sends a key. Returns the queued request, which can be passed to
+        cancel_key()."""
         _LOGGER.info('Queueing key %s', key)
         frame = self._get_key_event_frame(key)
 
         # Queue it to send immediately following the reception
         # of a keep-alive packet in an attempt to avoid bus collisions.
-        self._send_queue.put({'frame': frame})
+        request = {'frame': frame, 'priority': priority}
+        self._send_queue.put(request, priority)
+        return request
+
+    def cancel_key(self, request):
+        """Removes a request returned by send_key() from the queue.
+        Returns False if it has already been sent."""
+        return self._send_queue.remove(request)
+
+    def history(self, field, since=None, resolution=0):
+        """Returns the readings of field, one of HISTORY_FIELDS, as a list
+        of (timestamp, value) pairs, oldest first, from the time.time()
+        value since onwards. Recent readings are returned as received;
+        older ones, beyond the readings kept, as minute or hour averages,
+        as are all readings if resolution is 60 or 3600 seconds."""
+        if field not in HISTORY_FIELDS:
+            raise ValueError('No history for {}'.format(field))
+        if self._history is None or field not in self._history:
+            return []
+        return self._history[field].items(since, resolution)
+
+    @property
+    def queue_depth(self):
+        """Returns the number of commands waiting to be sent."""
+        return len(self._send_queue)
+
+    @property
+    def queue_drain_time(self):
+        """Returns the expected time in seconds until all queued commands
+        have been sent at the current burst size of frames per keep-alive,
+        not counting any retries."""
+        return (math.ceil(len(self._send_queue) / self._burst_limit) *
+                self._keep_alive_interval)
+
+    @property
+    def frame_time(self):
+        """Returns the time.monotonic() value at which the most recent
+        frame was read from the bus, or None if none has been. Compare it
+        with time.monotonic() in a callback to measure latency."""
+        return self._frame_start_time
 
     @property
     def air_temp(self):
@@ -503,6 +861,25 @@ class AquaLogic():
         """Returns the current salt level, or None if unknown."""
         return self._salt_level
 
+    @property
+    def display_text(self):
+        """Returns the text currently shown on the display, or None if
+        unknown. It changes with nearly every display frame, so changes
+        are only reported to subscribe('display_text', ...) callbacks."""
+        return self._display_text
+
+    @property
+    def pool_heater_setpoint(self):
+        """Returns the pool heater setpoint, or None if unknown or off.
+        Only known once it has been shown in the settings menu."""
+        return self._pool_heater_setpoint
+
+    @property
+    def spa_heater_setpoint(self):
+        """Returns the spa heater setpoint, or None if unknown or off.
+        Only known once it has been shown in the settings menu."""
+        return self._spa_heater_setpoint
+
     @property
     def check_system_msg(self):
         """Returns the current 'Check System' message, or None if unknown."""
@@ -529,6 +906,20 @@ class AquaLogic():
            Requires a Hayward VSP pump connected to the AquaLogic bus."""
         return self._pump_power
 
+    @property
+    def pump_energy_kwh(self):
+        """Returns the energy used by the pump today in kWh, or None if
+           unknown. Requires a Hayward VSP pump connected to the AquaLogic
+           bus."""
+        return self._pump_energy_kwh
+
+    def pump_energy(self, day=None):
+        """Returns a dict of the energy in kWh used by the pump on the
+           given date, by default today, keyed by the lower bound of each
+           speed band in percent; see aqualogic.energy."""
+        return {band: wh / 1000
+                for band, wh in self._pump_energy.wh(day).items()}
+
     @property
     def is_metric(self):
         """Returns True if the temperature and salt level values
@@ -556,34 +947,54 @@ class AquaLogic():
         """Returns True if super chlorinate is on"""
         return self.get_state(States.SUPER_CHLORINATE)
 
+    def snapshot(self):
+        """Returns a PanelSnapshot of the values as of the last frame that
+        changed any of them. It is safe to call from any thread; the
+        snapshot never changes, so its values are always consistent with
+        each other."""
+        return self._snapshot
+
     def states(self):
         """Returns a set containing the enabled states."""
-        state_list = []
-        for state in States:
-            if state.value & self._states != 0:
-                state_list.append(state)
+        return self._enabled_states
 
-        if (self._flashing_states & States.FILTER) != 0:
-            state_list.append(States.FILTER_LOW_SPEED)
+    @property
+    def states_mask(self):
+        """Returns the enabled states as a bitmask of States values."""
+        return self._states_mask
 
-        return state_list
+    def changed_states(self, old_mask):
+        """Returns a set containing the states that differ between
+        old_mask, a previous value of states_mask, and the current one."""
+        return _states_in_mask(old_mask ^ self._states_mask)
 
     def get_state(self, state):
         """Returns True if the specified state is enabled."""
         # Check to see if we have a change request pending; if we do
         # return the value we expect it to change to.
-        for data in list(self._send_queue.queue):
-            desired_states = data['desired_states']
-            for desired_state in desired_states:
-                if desired_state['state'] == state:
-                    return desired_state['enabled']
-        if state == States.FILTER_LOW_SPEED:
-            return (States.FILTER.value & self._flashing_states) != 0
-        return (state.value & self._states) != 0
+        desired_state = self._pending_states.get(state)
+        if desired_state is not None:
+            return desired_state['enabled']
+        return self._get_actual_state(state)
+
+    def _get_actual_state(self, state):
+        """Returns True if the unit reports the specified state enabled."""
+        return (state.value & self._states_mask) != 0
 
-    def set_state(self, state, enable):
+    def set_state(self, state, enable, priority=Priority.HIGH):
         """Set the state."""
 
+        desired_state = self._pending_states.get(state)
+        if (desired_state is not None and desired_state['enabled'] != enable
+                and self._send_queue.remove(desired_state['request'])):
+            # The opposite change hasn't been sent yet; drop it rather
+            # than pressing the key twice.
+            _LOGGER.info('Cancelled queued change of %s', state.name)
+            for desired_state in desired_state['request']['desired_states']:
+                if (self._pending_states.get(desired_state['state']) is
+                        desired_state):
+                    del self._pending_states[desired_state['state']]
+
         is_enabled = self.get_state(state)
         if is_enabled == enable:
             return True
@@ -628,11 +1039,16 @@ class AquaLogic():
             desired_states = [{'state': state, 'enabled': not is_enabled}]
 
         frame = self._get_key_event_frame(key)
+        request = {'frame': frame, 'desired_states': desired_states,
+                   'retries': 10, 'priority': priority}
+
+        for desired_state in desired_states:
+            desired_state['request'] = request
+            self._pending_states[desired_state['state']] = desired_state
 
         # Queue it to send immediately following the reception
         # of a keep-alive packet in an attempt to avoid bus collisions.
-        self._send_queue.put({'frame': frame, 'desired_states': desired_states,
-                              'retries': 10})
+        self._send_queue.put(request, priority)
 
         return True
 
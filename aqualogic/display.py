@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Parser for the text shown on the AquaLogic/ProLogic display."""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+# Each extractor takes the whitespace separated words of the display text
+# and returns a tuple of (field, value) pairs. Field names are the
+# AquaLogic attribute names without the leading underscore.
+
+def _temperature(field):
+    def extract(parts):
+        # <Pool|Spa|Air> Temp <temp>°[C|F]
+        return ((field, int(parts[2][:-2])),
+                ('is_metric', parts[2][-1:] == 'C'))
+    return extract
+
+
+def _percentage(field):
+    def extract(parts):
+        # <Pool|Spa> Chlorinator <value>%
+        return ((field, int(parts[2][:-1])),)
+    return extract
+
+
+def _salt_level(parts):
+    # Salt Level <value> [g/L|PPM]
+    return (('salt_level', float(parts[2])),
+            ('is_metric', parts[3] == 'g/L'))
+
+
+def _check_system(parts):
+    # Check System <msg>
+    return (('check_system_msg', ' '.join(parts[2:])),)
+
+
+def _chlorinator_off(parts):
+    # Chlorinator Off No Flow; possible pressure issue
+    if parts[2] == 'No' and parts[3] == 'Flow':
+        return (('check_system_msg', ' '.join(parts[2:])),)
+    return ()
+
+
+def _gas_heater(parts):
+    # Gas Heater [Auto Control|Manual Off]
+    if parts[2] == 'Auto' and parts[3] == 'Control':
+        value = True
+    elif parts[2] == 'Manual' and parts[3] == 'Off':
+        value = False
+    else:
+        return ()
+    return (('heater_auto_mode', value), ('heater_enabled', value))
+
+
+def _super_chlorinate(parts):
+    # Super Chlorinate <value> remaining
+    if parts[3] == 'remaining':
+        value = parts[2].replace(" ", "")
+        value = value.replace("º", ":")
+        return (('super_chlor_time_remain', value),)
+    return ()
+
+
+def _heater1(parts):
+    # Heater1 [Auto Control|...]
+    return (('heater_auto_mode', parts[1] == 'Auto'),)
+
+
+def _heater_setpoint(field):
+    def extract(parts):
+        # <Pool|Spa> Heater1 [<temp>°[C|F]|Off], from the settings menu
+        if parts[2] == 'Off':
+            return ((field, None),)
+        return ((field, int(parts[2][:-2])),
+                ('is_metric', parts[2][-1:] == 'C'))
+    return extract
+
+
+# Keyed on the first two words of the display
+_PARSERS = {
+    ('Pool', 'Temp'): _temperature('pool_temp'),
+    ('Spa', 'Temp'): _temperature('spa_temp'),
+    ('Air', 'Temp'): _temperature('air_temp'),
+    ('Pool', 'Chlorinator'): _percentage('pool_chlorinator'),
+    ('Spa', 'Chlorinator'): _percentage('spa_chlorinator'),
+    ('Salt', 'Level'): _salt_level,
+    ('Check', 'System'): _check_system,
+    ('Chlorinator', 'Off'): _chlorinator_off,
+    ('Gas', 'Heater'): _gas_heater,
+    ('Super', 'Chlorinate'): _super_chlorinate,
+    ('Pool', 'Heater1'): _heater_setpoint('pool_heater_setpoint'),
+    ('Spa', 'Heater1'): _heater_setpoint('spa_heater_setpoint'),
+}
+
+# Keyed on the first word only, for displays not matched above
+_FIRST_WORD_PARSERS = {
+    'Heater1': _heater1,
+}
+
+
+def parse_display_text(text):
+    """Returns the (field, value) pairs shown by the given display text."""
+    parts = text.split()
+    if len(parts) < 2:
+        return ()
+    extract = (_PARSERS.get((parts[0], parts[1])) or
+               _FIRST_WORD_PARSERS.get(parts[0]))
+    if extract is None:
+        return ()
+    try:
+        return extract(parts)
+    except (ValueError, IndexError):
+        return ()
+
+
+# Control characters, such as the attribute byte that ends a display
+# update, are shown as spaces; the panel's degree sign is 0xDF.
+_DISPLAY_CHARACTERS = bytes(b if b >= 0x20 else 0x20 for b in range(256))
+_DISPLAY_CHARACTERS = _DISPLAY_CHARACTERS.replace(b'\xdf', b'\xb0')
+
+
+def display_frame_text(frame):
+    """Returns the text shown by a display update or long display update
+    frame."""
+    return frame.translate(_DISPLAY_CHARACTERS).decode('latin-1').rstrip()
+
+
+class DisplayParser():
+    """Parses display update frames, caching the result for each distinct
+    frame since the panel cycles through the same few displays."""
+
+    CACHE_SIZE = 64
+
+    def __init__(self):
+        self._cache = {}
+
+    def parse(self, frame):
+        """Returns the (field, value) pairs shown by a display frame,
+        starting with ('display_text', text)."""
+        try:
+            return self._cache[frame]
+        except KeyError:
+            pass
+
+        text = display_frame_text(frame)
+        _LOGGER.debug('Display update: %s', text.split())
+        result = (('display_text', text),) + tuple(parse_display_text(text))
+
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[bytes(frame)] = result
+        return result
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Pump energy accounting from VSP pump status samples."""
+
+from collections import OrderedDict
+import datetime
+
+
+class EnergyMeter():
+    """Integrates pump power over time into watt-hours per day and per
+    speed band.
+
+    Each interval between two samples is credited to the day and speed
+    band of the sample that starts it, using the average of the two power
+    readings. Intervals longer than MAX_GAP seconds, e.g. while the
+    connection was down, are not counted."""
+
+    MAX_GAP = 30
+    # Speed bands are BAND_WIDTH percent wide, keyed by their lower bound
+    BAND_WIDTH = 10
+    # Number of days kept, including today
+    DAYS = 31
+
+    def __init__(self):
+        self._days = OrderedDict()
+        self._last_sample = None
+        self.total_wh = 0.0
+
+    def add(self, timestamp, watts, speed, day=None):
+        """Adds a sample of the pump power in watts at a speed in percent.
+        timestamp is a time.monotonic() value; day is the date of the
+        sample and defaults to today."""
+        if day is None:
+            day = datetime.date.today()
+        if self._last_sample is not None:
+            last_timestamp, last_watts, last_speed, last_day = self._last_sample
+            elapsed = timestamp - last_timestamp
+            if 0 < elapsed <= self.MAX_GAP:
+                band = last_speed - last_speed % self.BAND_WIDTH
+                wh = (last_watts + watts) / 2 * elapsed / 3600
+                bands = self._day(last_day)
+                bands[band] = bands.get(band, 0.0) + wh
+                self.total_wh += wh
+        self._day(day)
+        self._last_sample = (timestamp, watts, speed, day)
+
+    def wh(self, day=None):
+        """Returns a dict of the watt-hours used on a day, keyed by the
+        lower bound of each speed band. day defaults to today."""
+        if day is None:
+            day = datetime.date.today()
+        return dict(self._days.get(day, {}))
+
+    def day_wh(self, day=None):
+        """Returns the watt-hours used on a day, by default today."""
+        return sum(self.wh(day).values())
+
+    @property
+    def days(self):
+        """Returns the dates with energy recorded, oldest first."""
+        return list(self._days)
+
+    def _day(self, day):
+        bands = self._days.get(day)
+        if bands is None:
+            bands = self._days[day] = {}
+            while len(self._days) > self.DAYS:
+                self._days.popitem(last=False)
+        return bands
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Framing for the Hayward/Goldline AquaLogic/ProLogic RS-485 bus."""
+
+import binascii
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+DLE = 0x10
+STX = 0x02
+ETX = 0x03
+
+FRAME_START = bytes([DLE, STX])
+FRAME_END = bytes([DLE, ETX])
+
+_DLE_BYTE = bytes([DLE])
+_STUFFED_DLE = bytes([DLE, 0])
+
+
+def checksum(data):
+    """Returns the 16-bit checksum of a frame's type and payload, which
+    also covers the DLE and STX of the start sequence."""
+    return (DLE + STX + sum(memoryview(data))) & 0xffff
+
+
+def stuff(data):
+    """Inserts a NUL after every DLE in data."""
+    return data.replace(_DLE_BYTE, _STUFFED_DLE)
+
+
+def unstuff(data):
+    """Removes the NUL inserted after every DLE in data."""
+    return data.replace(_STUFFED_DLE, _DLE_BYTE)
+
+
+class FrameDecoder():
+    """Incremental decoder for the AquaLogic bus framing.
+
+    Data can be fed in chunks of any size, from any transport; partial
+    frames are kept until the rest of the frame arrives."""
+
+    # Data framing (from the AQ-CO-SERIAL manual):
+    #
+    # Each frame begins with a DLE (10H) and STX (02H) character start
+    # sequence, followed by a 2 to 61 byte long Command/Data field, a
+    # 2-byte Checksum and a DLE (10H) and ETX (03H) character end
+    # sequence.
+    #
+    # The DLE, STX and Command/Data fields are added together to
+    # provide the 2-byte Checksum. If any of the bytes of the
+    # Command/Data Field or Checksum are equal to the DLE character
+    # (10H), a NULL character (00H) is inserted into the transmitted
+    # data stream immediately after that byte. That NULL character
+    # must then be removed by the receiver.
+    #
+    # Because of the stuffing a DLE/STX or DLE/ETX pair can never occur
+    # inside a frame, so both can be located with bytes.find().
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.bad_frames = 0
+
+    def reset(self):
+        """Discards any partially received frame."""
+        self._buffer.clear()
+
+    def feed(self, data):
+        """Adds data received from the bus. Returns a list of
+        (frame_type, payload) tuples for the frames it completed."""
+        buf = self._buffer
+        buf += data
+        frames = []
+        pos = 0
+        while True:
+            start = buf.find(FRAME_START, pos)
+            if start < 0:
+                # Keep a trailing DLE; it may be the start of a frame.
+                if buf.endswith(FRAME_START[:1]):
+                    pos = len(buf) - 1
+                else:
+                    pos = len(buf)
+                break
+            end = buf.find(FRAME_END, start + 2)
+            if end < 0:
+                pos = start
+                break
+            # Resynchronize on the last start sequence if a frame was cut off
+            restart = buf.rfind(FRAME_START, start + 2, end)
+            if restart >= 0:
+                start = restart
+            pos = end + 2
+
+            frame = unstuff(bytes(buf[start + 2:end]))
+            decoded = self._decode(frame)
+            if decoded is not None:
+                frames.append(decoded)
+        del buf[:pos]
+        return frames
+
+    def _decode(self, frame):
+        if len(frame) < 4:
+            self.bad_frames += 1
+            _LOGGER.warning('Short frame: %s', binascii.hexlify(frame))
+            return None
+
+        # Verify CRC
+        frame_crc = int.from_bytes(frame[-2:], byteorder='big')
+        frame = frame[:-2]
+
+        if frame_crc != checksum(frame):
+            self.bad_frames += 1
+            _LOGGER.warning('Bad CRC')
+            return None
+
+        return frame[0:2], frame[2:]
+
+
+def encode_frame(frame_type, payload=b''):
+    """Returns the complete bus frame for a frame type and payload, with
+    checksum, DLE-NUL stuffing and start and end sequences."""
+    frame = frame_type + payload
+    frame += checksum(frame).to_bytes(2, byteorder='big')
+    return FRAME_START + stuff(frame) + FRAME_END
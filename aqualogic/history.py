@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""In-memory history of numeric panel readings.
+
+Each field keeps its readings in fixed-size ring buffers: one of the
+readings themselves, and coarser tiers holding the average over each
+minute and each hour, so recent trends can be read without a database.
+Timestamps are time.time() values."""
+
+from array import array
+from bisect import bisect_left
+
+
+class RingBuffer():
+    """Fixed number of (timestamp, value) pairs stored in arrays of
+    doubles; once full, each new pair replaces the oldest."""
+
+    def __init__(self, capacity):
+        self._times = array('d', bytes(8 * capacity))
+        self._values = array('d', bytes(8 * capacity))
+        self._capacity = capacity
+        self._next = 0
+        self._count = 0
+        self.overwritten = False
+
+    def __len__(self):
+        return self._count
+
+    def oldest(self):
+        """Returns the timestamp of the oldest pair, or None if empty."""
+        if not self._count:
+            return None
+        return self._times[(self._next - self._count) % self._capacity]
+
+    def append(self, timestamp, value):
+        """Adds a pair, replacing the oldest one if full."""
+        self._times[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self._capacity
+        if self._count < self._capacity:
+            self._count += 1
+        else:
+            self.overwritten = True
+
+    def items(self, since=None):
+        """Returns a list of the (timestamp, value) pairs, oldest first,
+        starting at since if given."""
+        start = self._next - self._count
+        if start >= 0:
+            times = self._times[start:self._next]
+            values = self._values[start:self._next]
+        else:
+            times = self._times[start:] + self._times[:self._next]
+            values = self._values[start:] + self._values[:self._next]
+        first = 0 if since is None else bisect_left(times, since)
+        return list(zip(times[first:], values[first:]))
+
+
+class _Tier():
+    """Ring buffer of averages over consecutive intervals of the given
+    number of seconds."""
+
+    def __init__(self, interval, capacity):
+        self.interval = interval
+        self.buffer = RingBuffer(capacity)
+        self._bucket = None
+        self._total = 0.0
+        self._count = 0
+
+    def add(self, timestamp, value):
+        bucket = timestamp - timestamp % self.interval
+        if bucket != self._bucket:
+            if self._count:
+                self.buffer.append(self._bucket, self._total / self._count)
+            self._bucket = bucket
+            self._total = 0.0
+            self._count = 0
+        self._total += value
+        self._count += 1
+
+    def items(self, since=None):
+        items = self.buffer.items(since)
+        # Include the interval in progress
+        if self._count and (since is None or
+                            self._bucket + self.interval > since):
+            items.append((self._bucket, self._total / self._count))
+        return items
+
+
+class FieldHistory():
+    """History of one field: every reading, plus minute and hour
+    averages."""
+
+    READINGS = 720
+    MINUTES = 24 * 60
+    HOURS = 31 * 24
+
+    def __init__(self):
+        self._readings = RingBuffer(self.READINGS)
+        self._tiers = (_Tier(60, self.MINUTES), _Tier(3600, self.HOURS))
+
+    def add(self, timestamp, value):
+        """Records a reading."""
+        self._readings.append(timestamp, value)
+        for tier in self._tiers:
+            tier.add(timestamp, value)
+
+    def items(self, since=None, resolution=0):
+        """Returns a list of (timestamp, value) pairs from since onwards,
+        oldest first. They come from the finest series with samples at
+        least resolution seconds apart, and before its oldest sample from
+        the next coarser series that reaches further back, and so on. The
+        timestamp of an average is the start of its interval."""
+        series = [(0, self._readings.items, self._readings)]
+        series += [(tier.interval, tier.items, tier.buffer)
+                   for tier in self._tiers]
+        series = [entry for entry in series
+                  if entry[0] >= resolution] or series[-1:]
+        items = []
+        # Start of the span covered by finer series
+        end = None
+        for interval, series_items, buffer in series:
+            older = series_items(since)
+            if end is not None:
+                # Only averages over intervals before the finer samples
+                older = [item for item in older if item[0] + interval <= end]
+            items = older + items
+            if not buffer.overwritten or (since is not None and
+                                          buffer.oldest() <= since):
+                break
+            end = buffer.oldest()
+        return items
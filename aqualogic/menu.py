@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Menu navigation macros for reading and changing panel settings.
+
+The panel has no commands for its settings; they can only be reached by
+pressing keys and watching the display. A Menu drives an AsyncAquaLogic
+through the settings menu, sending each key as soon as the display shows
+that the previous one has taken effect:
+
+    await panel.menu.set_pool_setpoint(84)
+    settings = await panel.menu.read_all_settings()
+
+The display is 2 lines of 16 characters. In the settings menu the first
+line is the title of a setting and the second its value, which blinks."""
+
+import asyncio
+import logging
+
+from .commands import Priority
+from .core import Keys
+
+_LOGGER = logging.getLogger(__name__)
+
+LINE_LENGTH = 16
+
+
+class MenuError(Exception):
+    """Raised when the display doesn't show what a macro expects."""
+
+
+def display_title(text):
+    """Returns the first line of display text, without padding."""
+    return text[:LINE_LENGTH].strip()
+
+
+def display_value(text):
+    """Returns the second line of display text, without padding."""
+    return ' '.join(text[LINE_LENGTH:].split())
+
+
+def _is_menu(text, name=None):
+    words = text.split()
+    return (len(words) == 2 and words[1] == 'Menu' and
+            (name is None or words[0] == name))
+
+
+def _setpoint(value):
+    # <temp>°[C|F] or Off
+    if value == 'Off':
+        return None
+    return int(value.split()[0][:-2])
+
+
+def _percentage(value):
+    # <value>% [On|Off]
+    return int(value.split()[0][:-1])
+
+
+class Menu():
+    """Runs menu macros on an AsyncAquaLogic, one at a time.
+
+    Keys are queued at Priority.LOW, behind commands from users. A key
+    that is still queued after KEY_TIMEOUT seconds is queued again, up to
+    KEY_RETRIES times; one that has been sent is never sent twice."""
+
+    KEY_TIMEOUT = 3.0
+    KEY_RETRIES = 2
+    # Time to wait for a blinking value to be shown
+    BLINK_TIMEOUT = 1.5
+    # Most key presses a macro will make to reach or change a setting
+    MAX_PRESSES = 64
+
+    def __init__(self, panel):
+        self._panel = panel
+        self._lock = asyncio.Lock()
+        self._waiters = []
+        # Titles seen in the settings menu
+        self._settings = set()
+        self.priority = Priority.LOW
+        panel.subscribe('display_text', self._display_changed)
+
+    async def read_all_settings(self):
+        """Returns a dict of the value shown for each setting in the
+        settings menu, keyed by its title, in one pass through the menu.
+        Settings the panel parses, such as heater setpoints, are also
+        updated on the panel."""
+        async with self._lock:
+            await self._enter_settings()
+            settings = {}
+            for _ in range(self.MAX_PRESSES):
+                text = await self._press_right()
+                if _is_menu(text, 'Settings'):
+                    return settings
+                text = await self._shown_value(text)
+                settings[display_title(text)] = display_value(text)
+            raise MenuError('Settings menu did not wrap around')
+
+    async def read_setting(self, title):
+        """Returns the value shown for the setting with the given title,
+        e.g. 'Pool Heater1'."""
+        async with self._lock:
+            text = await self._go_to(title)
+            return display_value(await self._shown_value(text))
+
+    async def set_pool_setpoint(self, value):
+        """Sets the pool heater setpoint; None turns the heater off."""
+        await self.set_setting('Pool Heater1', value, _setpoint)
+
+    async def set_spa_setpoint(self, value):
+        """Sets the spa heater setpoint; None turns the heater off."""
+        await self.set_setting('Spa Heater1', value, _setpoint)
+
+    async def set_pool_chlorinator(self, value):
+        """Sets the pool chlorinator output in percent."""
+        await self.set_setting('Pool Chlorinator', value, _percentage)
+
+    async def set_spa_chlorinator(self, value):
+        """Sets the spa chlorinator output in percent."""
+        await self.set_setting('Spa Chlorinator', value, _percentage)
+
+    async def set_setting(self, title, value, parse):
+        """Presses PLUS or MINUS on the setting with the given title until
+        parse(value shown) == value. parse returns None for the lowest
+        setting, e.g. Off. Raises MenuError if the value shown steps past
+        value, e.g. 33% when the panel steps by 5%."""
+        async with self._lock:
+            text = await self._shown_value(await self._go_to(title))
+            last_key = None
+            for _ in range(self.MAX_PRESSES):
+                try:
+                    current = parse(display_value(text))
+                except (ValueError, IndexError):
+                    raise MenuError('Unexpected value for {}: {!r}'.format(
+                        title, display_value(text))) from None
+                if current == value:
+                    _LOGGER.info('%s set to %s', title, display_value(text))
+                    return
+                if current is None or (value is not None and current < value):
+                    key = Keys.PLUS
+                else:
+                    key = Keys.MINUS
+                shown = display_value(text)
+                if last_key is not None and key != last_key:
+                    raise MenuError('{} can not be set to {}; it is {}'.format(
+                        title, value, shown))
+                last_key = key
+                text = await self.press(
+                    key, lambda text: (display_title(text) == title and
+                                       display_value(text) not in ('', shown)))
+            raise MenuError('Could not set {} to {}'.format(title, value))
+
+    async def press(self, key, expected):
+        """Sends key, then waits for display text for which expected(text)
+        is true, and returns it."""
+        future = asyncio.get_running_loop().create_future()
+        waiter = (expected, future)
+        self._waiters.append(waiter)
+        request = self._panel.send_key(key, self.priority)
+        try:
+            for attempt in range(self.KEY_RETRIES + 1):
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future),
+                                                  self.KEY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    _LOGGER.info('No response to %s, attempt %d', key.name,
+                                 attempt + 1)
+                # Resend only if the key is still queued; once sent, a
+                # second press would move on twice.
+                if self._panel.cancel_key(request):
+                    request = self._panel.send_key(key, self.priority)
+        finally:
+            # Don't press the key after giving up
+            self._panel.cancel_key(request)
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        raise MenuError('No response to {}; display shows {!r}'.format(
+            key.name, self._panel.display_text))
+
+    def _in_settings(self, text):
+        return (_is_menu(text, 'Settings') or
+                display_title(text) in self._settings)
+
+    async def _enter_settings(self):
+        """Shows the settings menu title."""
+        for _ in range(self.MAX_PRESSES):
+            text = self._panel.display_text or ''
+            if _is_menu(text, 'Settings'):
+                return text
+            if self._in_settings(text):
+                # The settings wrap around to the menu title
+                await self._press_right()
+            elif _is_menu(text):
+                # From one menu to the next
+                await self.press(Keys.MENU, lambda new, old=text: (
+                    _is_menu(new) and new.split() != old.split()))
+            else:
+                await self.press(Keys.MENU, _is_menu)
+        raise MenuError('Settings menu not found')
+
+    async def _go_to(self, title):
+        """Shows the setting with the given title."""
+        text = self._panel.display_text or ''
+        if display_title(text) == title:
+            return text
+        if not self._in_settings(text):
+            await self._enter_settings()
+        wraps = 0
+        for _ in range(self.MAX_PRESSES):
+            text = await self._press_right()
+            if display_title(text) == title:
+                return text
+            if _is_menu(text, 'Settings'):
+                wraps += 1
+                if wraps == 2:
+                    break
+        raise MenuError('Setting {} not found'.format(title))
+
+    async def _press_right(self):
+        """Moves to the next setting."""
+        title = display_title(self._panel.display_text or '')
+        text = await self.press(
+            Keys.RIGHT, lambda text: display_title(text) != title)
+        if not _is_menu(text):
+            self._settings.add(display_title(text))
+        return text
+
+    async def _shown_value(self, text):
+        """Returns text, or the next display text of the same setting if
+        its value is blinked off; settings with no value are returned as
+        they are after BLINK_TIMEOUT."""
+        if display_value(text):
+            return text
+        title = display_title(text)
+        future = asyncio.get_running_loop().create_future()
+        waiter = (lambda new: (display_title(new) == title and
+                               display_value(new) != ''), future)
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, self.BLINK_TIMEOUT)
+        except asyncio.TimeoutError:
+            return text
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _display_changed(self, panel):
+        text = panel.display_text
+        for waiter in list(self._waiters):
+            expected, future = waiter
+            if not future.done() and expected(text):
+                self._waiters.remove(waiter)
+                future.set_result(text)
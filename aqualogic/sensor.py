@@ -10,10 +10,12 @@ from homeassistant.components.sensor import (
     SensorDeviceClass,
     SensorEntity,
     SensorEntityDescription,
+    SensorStateClass,
 )
 from homeassistant.const import (
     CONF_MONITORED_CONDITIONS,
     PERCENTAGE,
+    UnitOfEnergy,
     UnitOfPower,
     UnitOfTemperature,
 )
@@ -23,7 +25,7 @@ from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 
-from . import DOMAIN, UPDATE_TOPIC, AquaLogicProcessor
+from . import DOMAIN, AquaLogicProcessor, update_topic
 
 
 @dataclass
@@ -94,6 +96,15 @@ SENSOR_TYPES: tuple[AquaLogicSensorEntityDescription, ...] = (
         unit_imperial=UnitOfPower.WATT,
         device_class=SensorDeviceClass.POWER,
     ),
+    AquaLogicSensorEntityDescription(
+        key="pump_energy_kwh",
+        name="Pump Energy Today",
+        unit_metric=UnitOfEnergy.KILO_WATT_HOUR,
+        unit_imperial=UnitOfEnergy.KILO_WATT_HOUR,
+        device_class=SensorDeviceClass.ENERGY,
+        # Resets at midnight
+        state_class=SensorStateClass.TOTAL_INCREASING,
+    ),
     AquaLogicSensorEntityDescription(
         key="status",
         name="Status",
@@ -123,7 +134,8 @@ async def async_setup_platform(
     monitored_conditions = config[CONF_MONITORED_CONDITIONS]
 
     entities = [
-        AquaLogicSensor(processor, description)
+        AquaLogicSensor(processor, panel_name, description)
+        for panel_name in processor.panel_names
         for description in SENSOR_TYPES
         if description.key in monitored_conditions
     ]
@@ -140,26 +152,39 @@ class AquaLogicSensor(SensorEntity):
     def __init__(
         self,
         processor: AquaLogicProcessor,
+        panel_name: str | None,
         description: AquaLogicSensorEntityDescription,
     ) -> None:
         """Initialize sensor."""
         self.entity_description = description
         self._processor = processor
-        self._attr_name = f"AquaLogic {description.name}"
+        self._panel_name = panel_name
+        if panel_name is None:
+            self._attr_name = f"AquaLogic {description.name}"
+        else:
+            self._attr_name = f"AquaLogic {panel_name} {description.name}"
 
     async def async_added_to_hass(self) -> None:
         """Register callbacks."""
-        self.async_on_remove(
-            async_dispatcher_connect(
-                self.hass, UPDATE_TOPIC, self.async_update_callback
+        keys = [self.entity_description.key]
+        if self.entity_description.unit_metric != self.entity_description.unit_imperial:
+            keys.append("is_metric")
+        for key in keys:
+            self.async_on_remove(
+                async_dispatcher_connect(
+                    self.hass,
+                    update_topic(key, self._panel_name),
+                    self.async_update_callback,
+                )
             )
-        )
 
     @callback
     def async_update_callback(self) -> None:
         """Update callback."""
-        if (panel := self._processor.panel) is not None:
-            if panel.is_metric:
+        if (panel := self._processor.get_panel(self._panel_name)) is not None:
+            # Read the value and its units from the same frame
+            snapshot = panel.snapshot()
+            if snapshot.is_metric:
                 self._attr_native_unit_of_measurement = (
                     self.entity_description.unit_metric
                 )
@@ -168,7 +193,9 @@ class AquaLogicSensor(SensorEntity):
                     self.entity_description.unit_imperial
                 )
 
-            self._attr_native_value = getattr(panel, self.entity_description.key)
+            self._attr_native_value = getattr(
+                snapshot, self.entity_description.key
+            )
             self.async_write_ha_state()
         else:
             self._attr_native_unit_of_measurement = None
\ No newline at end of file
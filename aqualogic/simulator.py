@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""Simulated AquaLogic/ProLogic panel for development and load testing
+without hardware.
+
+The simulator emits keep-alive, LED, display and pump frames like a panel
+on the RS-485 bus, toggles its LEDs in response to key event frames, and
+has a settings menu with heater setpoints and chlorinator outputs.
+It can be served on a TCP port (for AquaLogic.connect_socket) and on a
+pseudo-terminal (for AquaLogic.connect_serial):
+
+    python -m aqualogic.simulator --tcp 8899 --pty --rate 10
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import tty
+
+from .core import AquaLogic, Keys, States
+from .frame import FrameDecoder, encode_frame
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PanelSimulator():
+    """Bus behaviour of a panel, independent of any transport.
+
+    rate scales how often every frame type is sent; rate=10 sends ten
+    times as many frames per second as the defaults below."""
+
+    # pylint: disable=too-many-instance-attributes
+    KEEP_ALIVE_INTERVAL = 0.1
+    LEDS_INTERVAL = 0.5
+    DISPLAY_INTERVAL = 1.0
+    PUMP_STATUS_INTERVAL = 2.0
+
+    def __init__(self, rate=1.0, is_metric=False):
+        self.rate = rate
+        self.is_metric = is_metric
+        self.states = States.POOL | States.FILTER
+        self.flashing_states = 0
+        self.air_temp = 72
+        self.pool_temp = 80
+        self.spa_temp = 98
+        self.salt_level = 3200
+        self.pool_chlorinator = 50
+        self.pump_speed = 75
+        self.pump_power = 1250
+        self.pool_heater_setpoint = None
+        self.spa_heater_setpoint = None
+        self.pool_chlorinator_output = 50
+        self.spa_chlorinator_output = 0
+        # None while showing the normal rotation, else the index into
+        # menu_screens()
+        self.menu = None
+        self._display_index = 0
+        self._decoder = FrameDecoder()
+        self._next_due = {}
+
+    def tick(self, now):
+        """Returns the frames due to be sent at time now (in seconds)."""
+        frames = []
+        for name, interval, build in (
+                ('keep_alive', self.KEEP_ALIVE_INTERVAL, self.keep_alive_frame),
+                ('leds', self.LEDS_INTERVAL, self.leds_frame),
+                ('display', self.DISPLAY_INTERVAL, self.next_display_frame),
+                ('pump', self.PUMP_STATUS_INTERVAL, self.pump_frames)):
+            due = self._next_due.get(name, now)
+            if now >= due:
+                frames.append(build())
+                # Catch up without bursting if we fell behind
+                self._next_due[name] = max(due + interval / self.rate, now)
+        return b''.join(frames)
+
+    def next_due(self):
+        """Returns the time at which tick() next has frames to send."""
+        return min(self._next_due.values(), default=0)
+
+    def receive(self, data):
+        """Handles data written to the bus. Returns the frames the panel
+        sends in response."""
+        response = []
+        for frame_type, frame in self._decoder.feed(data):
+            key = self._decode_key(frame_type, frame)
+            if key is not None:
+                response.append(self.press(key))
+        return b''.join(response)
+
+    def press(self, key):
+        """Applies a key press. Returns the resulting LED and display
+        frames."""
+        _LOGGER.debug('Key %s', key.name)
+        if key in (Keys.MENU, Keys.RIGHT, Keys.LEFT, Keys.PLUS, Keys.MINUS):
+            self._press_menu_key(key)
+            if self.menu is None:
+                return self.next_display_frame()
+            return self.display_frame(self.menu_text())
+        if key == Keys.POOL_SPA:
+            self.states ^= States.POOL | States.SPA
+            if not self.states & (States.POOL | States.SPA):
+                self.states |= States.POOL
+            text = 'Pool Only' if self.states & States.POOL else 'Spa Only'
+        elif key == Keys.FILTER:
+            # Off -> high speed -> low speed (flashing) -> off
+            if not self.states & States.FILTER:
+                self.states |= States.FILTER
+                text = 'Filter Turned On'
+            elif not self.flashing_states & States.FILTER:
+                self.flashing_states |= States.FILTER
+                text = 'Filter Low Speed'
+            else:
+                self.states &= ~States.FILTER
+                self.flashing_states &= ~States.FILTER
+                text = 'Filter Turned Off'
+        elif key.name in States.__members__:
+            state = States[key.name]
+            self.states ^= state
+            text = '{} Turned {}'.format(
+                key.name.title().replace('_', ''),
+                'On' if self.states & state else 'Off')
+        else:
+            return b''
+        return self.leds_frame() + self.display_frame(text)
+
+    def keep_alive_frame(self):
+        """Returns a keep-alive frame."""
+        return encode_frame(AquaLogic.FRAME_TYPE_KEEP_ALIVE)
+
+    def leds_frame(self):
+        """Returns an LEDs frame for the current states."""
+        return encode_frame(
+            AquaLogic.FRAME_TYPE_LEDS,
+            self.states.to_bytes(4, byteorder='little') +
+            self.flashing_states.to_bytes(4, byteorder='little'))
+
+    def display_frame(self, text):
+        """Returns a display update frame showing text."""
+        return encode_frame(AquaLogic.FRAME_TYPE_DISPLAY_UPDATE,
+                            text.encode('latin-1') + b'\x00')
+
+    def next_display_frame(self):
+        """Returns the next display update in the panel's rotation."""
+        if self.menu is not None:
+            # The value being set blinks
+            self._display_index += 1
+            return self.display_frame(
+                self.menu_text(blank=self._display_index % 2 == 0))
+        texts = self.display_texts()
+        text = texts[self._display_index % len(texts)]
+        self._display_index += 1
+        return self.display_frame(text)
+
+    def display_texts(self):
+        """Returns the texts the panel cycles through."""
+        unit = 'C' if self.is_metric else 'F'
+        if self.is_metric:
+            salt = '{:.1f} g/L'.format(self.salt_level / 1000)
+        else:
+            salt = '{} PPM'.format(self.salt_level)
+        texts = [
+            'Air Temp   {:>3}\xdf{}'.format(self.air_temp, unit),
+            '   Salt Level       {}'.format(salt),
+            'Pool Chlorinator      {}%'.format(self.pool_chlorinator),
+            '    Heater1       Auto Control  ',
+        ]
+        if self.states & States.SPA:
+            texts.insert(0, ' Spa Temp  {:>3}\xdf{}'.format(self.spa_temp, unit))
+        else:
+            texts.insert(0, 'Pool Temp  {:>3}\xdf{}'.format(self.pool_temp, unit))
+        return [text.ljust(32) for text in texts]
+
+    # Heater setpoints run from Off through these limits
+    SETPOINT_RANGE = (65, 104)
+
+    def menu_screens(self):
+        """Returns the (title, value) screens of the menus, in the order
+        MENU and RIGHT step through them."""
+        unit = '\xdfC' if self.is_metric else '\xdfF'
+
+        def setpoint(value):
+            return 'Off' if value is None else '{}{}'.format(value, unit)
+        return [
+            ('Default', 'Menu'),
+            ('Settings', 'Menu'),
+            ('Spa Heater1', setpoint(self.spa_heater_setpoint)),
+            ('Pool Heater1', setpoint(self.pool_heater_setpoint)),
+            ('Spa Chlorinator', '{}%'.format(self.spa_chlorinator_output)),
+            ('Pool Chlorinator', '{}%'.format(self.pool_chlorinator_output)),
+        ]
+
+    def menu_text(self, blank=False):
+        """Returns the display text of the current menu screen."""
+        title, value = self.menu_screens()[self.menu]
+        if title == 'Settings' or title == 'Default':
+            return title.center(16) + value.center(16)
+        if blank:
+            value = ''
+        return title.ljust(16) + value.center(16)
+
+    def _press_menu_key(self, key):
+        screens = len(self.menu_screens())
+        if key == Keys.MENU:
+            # Default Menu -> Settings Menu -> back to the rotation, from
+            # any of the settings
+            self.menu = {None: 0, 0: 1}.get(self.menu)
+        elif self.menu is None or self.menu == 0:
+            pass
+        elif key == Keys.RIGHT:
+            self.menu = self.menu + 1 if self.menu + 1 < screens else 1
+        elif key == Keys.LEFT:
+            self.menu = self.menu - 1 if self.menu > 1 else screens - 1
+        else:
+            self._adjust(self.menu_screens()[self.menu][0],
+                         1 if key == Keys.PLUS else -1)
+
+    def _adjust(self, title, step):
+        if title.endswith('Heater1'):
+            attr = title.split()[0].lower() + '_heater_setpoint'
+            low, high = self.SETPOINT_RANGE
+            value = getattr(self, attr)
+            if value is None:
+                value = low if step > 0 else None
+            elif value + step < low:
+                value = None
+            else:
+                value = min(value + step, high)
+        elif title.endswith('Chlorinator'):
+            attr = title.split()[0].lower() + '_chlorinator_output'
+            value = max(0, min(getattr(self, attr) + step * 5, 100))
+        else:
+            return
+        setattr(self, attr, value)
+
+    def pump_frames(self):
+        """Returns a VSP pump speed request and status frame."""
+        if not self.states & States.FILTER:
+            speed, power = 0, 0
+        else:
+            speed, power = self.pump_speed, self.pump_power
+            if self.flashing_states & States.FILTER:
+                speed, power = speed // 2, power // 6
+        # Power is in BCD
+        bcd = int('{:04d}'.format(power), 16).to_bytes(2, byteorder='big')
+        return (encode_frame(AquaLogic.FRAME_TYPE_PUMP_SPEED_REQUEST,
+                             speed.to_bytes(2, byteorder='big')) +
+                encode_frame(AquaLogic.FRAME_TYPE_PUMP_STATUS,
+                             b'\x00\x00' + bytes([speed]) + bcd))
+
+    @staticmethod
+    def _decode_key(frame_type, frame):
+        try:
+            if frame_type in (AquaLogic.FRAME_TYPE_LOCAL_WIRED_KEY_EVENT,
+                              AquaLogic.FRAME_TYPE_REMOTE_WIRED_KEY_EVENT):
+                value = int.from_bytes(frame[0:2], byteorder='little')
+            elif frame_type == AquaLogic.FRAME_TYPE_WIRELESS_KEY_EVENT:
+                value = int.from_bytes(frame[1:5], byteorder='little')
+            else:
+                return None
+            return Keys(value)
+        except ValueError:
+            # Key released, or several keys at once
+            return None
+
+
+class _BusProtocol(asyncio.Protocol):
+    def __init__(self, bus):
+        self._bus = bus
+        self._transport = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._bus.clients.add(transport)
+
+    def data_received(self, data):
+        self._bus.receive(data)
+
+    def connection_lost(self, exc):
+        self._bus.clients.discard(self._transport)
+
+
+class _PtyTransport():
+    """Just enough of a transport to put a pty master on the bus."""
+
+    def __init__(self, fd):
+        self._fd = fd
+
+    def write(self, data):
+        try:
+            os.write(self._fd, data)
+        except BlockingIOError:
+            # Nobody is reading the slave side; the bus doesn't wait
+            pass
+
+
+class BusSimulator():
+    """Serves a PanelSimulator to any number of clients over TCP and
+    pseudo-terminals. All clients share the one simulated bus. With
+    echo=True, data written by a client is also sent back to every
+    client, as an RS-485 adapter that hears its own transmissions does."""
+
+    def __init__(self, panel=None, echo=False):
+        self.panel = panel if panel is not None else PanelSimulator()
+        self.echo = echo
+        self.clients = set()
+        self._servers = []
+        self._ptys = []
+        self._task = None
+
+    async def start_tcp(self, host='127.0.0.1', port=0):
+        """Starts serving on a TCP port. Returns the (host, port) bound."""
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _BusProtocol(self),
+                                          host, port)
+        self._servers.append(server)
+        self._start()
+        return server.sockets[0].getsockname()[:2]
+
+    def start_pty(self):
+        """Creates a pseudo-terminal on the bus. Returns the path of the
+        slave device to pass to AquaLogic.connect_serial()."""
+        loop = asyncio.get_running_loop()
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        transport = _PtyTransport(master)
+        self.clients.add(transport)
+        loop.add_reader(master, self._read_pty, master)
+        self._ptys.append((master, slave))
+        self._start()
+        return os.ttyname(slave)
+
+    def receive(self, data):
+        """Handles data written to the bus by a client."""
+        if self.echo:
+            self._broadcast(data)
+        response = self.panel.receive(data)
+        if response:
+            self._broadcast(response)
+
+    async def close(self):
+        """Stops the simulator and disconnects all clients."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        loop = asyncio.get_running_loop()
+        for master, slave in self._ptys:
+            loop.remove_reader(master)
+            os.close(master)
+            os.close(slave)
+        self._ptys = []
+        for client in list(self.clients):
+            if hasattr(client, 'close'):
+                client.close()
+        self.clients.clear()
+
+    def _start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            data = self.panel.tick(loop.time())
+            if data:
+                self._broadcast(data)
+            await asyncio.sleep(max(0, self.panel.next_due() - loop.time()))
+
+    def _broadcast(self, data):
+        for client in list(self.clients):
+            client.write(data)
+
+    def _read_pty(self, fd):
+        try:
+            data = os.read(fd, 4096)
+        except OSError:
+            return
+        if data:
+            self.receive(data)
+
+
+async def _main(args):
+    bus = BusSimulator(PanelSimulator(rate=args.rate, is_metric=args.metric),
+                       echo=args.echo)
+    if args.tcp is not None:
+        host, port = await bus.start_tcp(args.host, args.tcp)
+        print('Serving on {}:{}'.format(host, port))
+    if args.pty:
+        print('Serial port: {}'.format(bus.start_pty()))
+    await asyncio.Event().wait()
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description='AquaLogic bus simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--tcp', type=int, metavar='PORT',
+                        help='serve on this TCP port')
+    parser.add_argument('--pty', action='store_true',
+                        help='create a pseudo-terminal')
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help='frame rate multiplier')
+    parser.add_argument('--metric', action='store_true')
+    parser.add_argument('--echo', action='store_true',
+                        help='echo client writes back onto the bus')
+    args = parser.parse_args()
+    if args.tcp is None and not args.pty:
+        parser.error('at least one of --tcp or --pty is required')
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
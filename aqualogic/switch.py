@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from typing import Any
 
-from aqualogic.core import States
+from .core import States
 import voluptuous as vol
 
 from homeassistant.components.switch import PLATFORM_SCHEMA, SwitchEntity
@@ -14,7 +14,7 @@ from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 
-from . import DOMAIN, UPDATE_TOPIC, AquaLogicProcessor
+from . import DOMAIN, AquaLogicProcessor, update_topic
 
 SWITCH_TYPES = {
     "lights": "Lights",
@@ -50,8 +50,9 @@ async def async_setup_platform(
     switches = []
 
     processor: AquaLogicProcessor = hass.data[DOMAIN]
-    for switch_type in config[CONF_MONITORED_CONDITIONS]:
-        switches.append(AquaLogicSwitch(processor, switch_type))
+    for panel_name in processor.panel_names:
+        for switch_type in config[CONF_MONITORED_CONDITIONS]:
+            switches.append(AquaLogicSwitch(processor, panel_name, switch_type))
 
     async_add_entities(switches)
 
@@ -61,9 +62,12 @@ class AquaLogicSwitch(SwitchEntity):
 
     _attr_should_poll = False
 
-    def __init__(self, processor: AquaLogicProcessor, switch_type: str) -> None:
+    def __init__(
+        self, processor: AquaLogicProcessor, panel_name: str | None, switch_type: str
+    ) -> None:
         """Initialize switch."""
         self._processor = processor
+        self._panel_name = panel_name
         self._state_name = {
             "lights": States.LIGHTS,
             "filter": States.FILTER,
@@ -78,29 +82,36 @@ class AquaLogicSwitch(SwitchEntity):
             "heater_1": States.HEATER_1,
             "heater_auto_mode": States.HEATER_AUTO_MODE,
         }[switch_type]
-        self._attr_name = f"AquaLogic {SWITCH_TYPES[switch_type]}"
+        if panel_name is None:
+            self._attr_name = f"AquaLogic {SWITCH_TYPES[switch_type]}"
+        else:
+            self._attr_name = f"AquaLogic {panel_name} {SWITCH_TYPES[switch_type]}"
 
     @property
     def is_on(self) -> bool:
         """Return true if device is on."""
-        if (panel := self._processor.panel) is None:
+        if (panel := self._processor.get_panel(self._panel_name)) is None:
             return False
         return panel.get_state(self._state_name)  # type: ignore[no-any-return]
 
-    def turn_on(self, **kwargs: Any) -> None:
+    async def async_turn_on(self, **kwargs: Any) -> None:
         """Turn the device on."""
-        if (panel := self._processor.panel) is None:
+        if (panel := self._processor.get_panel(self._panel_name)) is None:
             return
         panel.set_state(self._state_name, True)
 
-    def turn_off(self, **kwargs: Any) -> None:
+    async def async_turn_off(self, **kwargs: Any) -> None:
         """Turn the device off."""
-        if (panel := self._processor.panel) is None:
+        if (panel := self._processor.get_panel(self._panel_name)) is None:
             return
         panel.set_state(self._state_name, False)
 
     async def async_added_to_hass(self) -> None:
         """Register callbacks."""
         self.async_on_remove(
-            async_dispatcher_connect(self.hass, UPDATE_TOPIC, self.async_write_ha_state)
+            async_dispatcher_connect(
+                self.hass,
+                update_topic(self._state_name, self._panel_name),
+                self.async_write_ha_state,
+            )
         )
\ No newline at end of file
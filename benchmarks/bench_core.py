@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the AquaLogic frame decode and state update paths.
+
+Usage: python benchmarks/bench_core.py [--json out.json]
+                                       [--baseline old.json] [file ...]
+
+Each file is either a capture written by AquaLogic.record() or raw bus
+data such as tests/data/*.bin; tests/data is used if none are given.
+Results can be saved with --json and compared against a previous run
+with --baseline."""
+
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+
+# pylint: disable=wrong-import-position
+from aqualogic.capture import MAGIC, read_capture
+from aqualogic.core import AquaLogic, Keys, States
+from aqualogic.frame import FrameDecoder, encode_frame
+
+
+def _keep_alive_flood(count):
+    return encode_frame(AquaLogic.FRAME_TYPE_KEEP_ALIVE) * count
+
+
+def _led_churn(count):
+    frames = []
+    for i in range(count):
+        states = States.POOL | States.FILTER | (States.AUX_1 << (i % 8))
+        frames.append(encode_frame(AquaLogic.FRAME_TYPE_LEDS,
+                                   states.to_bytes(4, byteorder='little') +
+                                   bytes(4)))
+        frames.append(encode_frame(AquaLogic.FRAME_TYPE_KEEP_ALIVE))
+    return b''.join(frames)
+
+
+_DISPLAYS = [
+    'Pool Temp  {}\xdfF                 ',
+    'Air Temp   {}\xdfF                 ',
+    '   Salt Level       3{}00 PPM   ',
+    'Pool Chlorinator      {}%       ',
+    '    Heater1       Auto Control  ',
+    '   Wednesday          2:{}P     ',
+]
+
+
+def _display_rotation(count):
+    frames = []
+    for i in range(count):
+        text = _DISPLAYS[i % len(_DISPLAYS)].format(70 + (i // 60) % 10)
+        frames.append(encode_frame(AquaLogic.FRAME_TYPE_DISPLAY_UPDATE,
+                                   text.encode('latin-1') + b'\x00'))
+        frames.append(encode_frame(AquaLogic.FRAME_TYPE_KEEP_ALIVE))
+    return b''.join(frames)
+
+
+def _pump_status(count):
+    frames = []
+    for i in range(count):
+        watts = 1000 + (i % 50)
+        bcd = int(str(watts), 16).to_bytes(2, byteorder='big')
+        frames.append(encode_frame(AquaLogic.FRAME_TYPE_PUMP_STATUS,
+                                   b'\x00\x00\x64' + bcd))
+        frames.append(encode_frame(AquaLogic.FRAME_TYPE_KEEP_ALIVE))
+    return b''.join(frames)
+
+
+def _load(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(MAGIC):
+        return b''.join(chunk for _, chunk in read_capture(io.BytesIO(data)))
+    return data
+
+
+def _chunks(data, size=AquaLogic.READ_SIZE):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _best(func, repeat=5):
+    """Returns the fastest of repeat calls to func, in seconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def bench_decode(data):
+    """FrameDecoder alone."""
+    chunks = _chunks(data)
+    frames = len(FrameDecoder().feed(data))
+
+    def run():
+        decoder = FrameDecoder()
+        for chunk in chunks:
+            decoder.feed(chunk)
+    return frames, _best(run), run
+
+
+def bench_process(data):
+    """AquaLogic.process() including frame handlers and callbacks."""
+    frames = len(FrameDecoder().feed(data))
+
+    def run():
+        panel = AquaLogic()
+        panel.connect_io(io.BytesIO(data))
+        panel.process(lambda panel, changed: None)
+    return frames, _best(run), run
+
+
+def _allocations(func):
+    """Returns the number of memory blocks allocated by func and not yet
+    freed when it returns, and the peak traced memory in bytes."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    return blocks, peak
+
+
+def bench_calls():
+    """Per-call timings of the state accessors and key frame encoding."""
+    panel = AquaLogic()
+    panel.connect_io(io.BytesIO(_led_churn(1)))
+    panel.process(lambda panel, changed: None)
+    for key in (Keys.AUX_1, Keys.AUX_2, Keys.AUX_3):
+        panel.send_key(key)
+    panel.set_state(States.LIGHTS, True)
+
+    number = 20000
+    calls = {
+        'get_state': lambda: panel.get_state(States.FILTER),
+        'states': panel.states,
+        'get_key_event_frame': lambda: panel._get_key_event_frame(Keys.AUX_1),
+    }
+    return {name: _best(lambda func=func: [func() for _ in range(number)]) /
+            number for name, func in calls.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with a --json file')
+    args = parser.parse_args()
+
+    streams = {
+        'keep-alive flood': _keep_alive_flood(20000),
+        'LED churn': _led_churn(5000),
+        'display rotation': _display_rotation(5000),
+        'pump status': _pump_status(5000),
+    }
+    files = args.files or sorted(glob.glob(os.path.join(
+        os.path.dirname(__file__), '..', 'tests', 'data', '*.bin')))
+    if files:
+        streams['captures'] = b''.join(_load(path) for path in files)
+
+    results = {}
+    print('{:<32} {:>8} {:>12} {:>12} {:>8} {:>10}'.format(
+        'benchmark', 'frames', 'frames/s', 'us/frame', 'retained', 'peak KiB'))
+    for name, data in streams.items():
+        for kind, bench in (('decode', bench_decode),
+                            ('process', bench_process)):
+            frames, elapsed, run = bench(data)
+            blocks, peak = _allocations(run)
+            label = '{} {}'.format(kind, name)
+            results[label] = {
+                'frames': frames,
+                'frames_per_sec': frames / elapsed,
+                'us_per_frame': elapsed / frames * 1e6,
+                'blocks': blocks,
+                'peak_bytes': peak,
+            }
+            print('{:<32} {:>8} {:>12.0f} {:>12.2f} {:>8} {:>10.1f}'.format(
+                label, frames, frames / elapsed, elapsed / frames * 1e6,
+                blocks, peak / 1024))
+
+    print()
+    for name, seconds in bench_calls().items():
+        results[name] = {'us_per_call': seconds * 1e6}
+        print('{:<32} {:>10.3f} us/call'.format(name, seconds * 1e6))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        print('Speedup against {}:'.format(args.baseline))
+        for name, result in results.items():
+            old = baseline.get(name)
+            if old is None:
+                continue
+            key = 'us_per_frame' if 'us_per_frame' in result else 'us_per_call'
+            print('{:<32} {:>8.2f}x'.format(name, old[key] / result[key]))
+
+    if args.json:
+        results['_meta'] = {'time': time.time(), 'python': sys.version}
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,5 +29,9 @@ setup(
   ],
   install_requires=[
     'pyserial',
-  ]  
+  ],
+  extras_require={
+    # Serial ports for aqualogic.aio.AsyncAquaLogic
+    'asyncio': ['pyserial-asyncio'],
+  }
 )
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.aio import AquaLogicManager, AsyncAquaLogic
+from aqualogic.core import AquaLogic, Keys, States
+from aqualogic.simulator import BusSimulator, PanelSimulator
+import asyncio
+
+KEEP_ALIVE = b'\x10\x02\x01\x01\x00\x14\x10\x03'
+
+
+async def _serve_file(path):
+    async def handle(reader, writer):
+        with open(path, 'rb') as f:
+            writer.write(f.read())
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+class TestAsyncAquaLogic(object):
+    def test_updates(self):
+        async def run():
+            server = await _serve_file('tests/data/pool_on.bin')
+            port = server.sockets[0].getsockname()[1]
+            aq = AsyncAquaLogic()
+            await aq.connect_socket('127.0.0.1', port)
+            updates = 0
+            changed = set()
+            async for update in aq.updates():
+                updates += 1
+                changed |= update
+            server.close()
+            await server.wait_closed()
+            return aq, updates, changed
+
+        aq, updates, changed = asyncio.run(run())
+        assert updates > 0
+        assert {'air_temp', 'pool_temp', 'is_metric', 'states'} <= changed
+        assert not aq.connected
+        assert aq.is_metric
+        assert aq.air_temp == -6
+        assert aq.pool_temp == -7
+        assert aq.salt_level == 3.1
+        assert aq.get_state(States.POOL)
+        assert not aq.get_state(States.SPA)
+        assert States.POOL in aq.states()
+        assert aq.states_mask & States.POOL
+        assert aq.changed_states(0) == aq.states()
+        assert aq.changed_states(aq.states_mask | States.SPA) == {States.SPA}
+
+    def test_notify_interval(self):
+        async def run():
+            server = await _serve_file('tests/data/pool_on.bin')
+            port = server.sockets[0].getsockname()[1]
+            aq = AsyncAquaLogic(notify_interval=60)
+            await aq.connect_socket('127.0.0.1', port)
+            updates = [update async for update in aq.updates()]
+            server.close()
+            await server.wait_closed()
+            return updates
+
+        # The first change is reported immediately, the rest are held
+        # back until the connection closes.
+        updates = asyncio.run(run())
+        assert len(updates) == 2
+        assert 'salt_level' in updates[1]
+
+    def test_subscribe(self):
+        async def run():
+            server = await _serve_file('tests/data/pool_on.bin')
+            port = server.sockets[0].getsockname()[1]
+            aq = AsyncAquaLogic()
+            calls = []
+            aq.subscribe(States.POOL, lambda panel: calls.append('pool'))
+            aq.subscribe('salt_level', lambda panel: calls.append('salt'))
+            unsubscribe = aq.subscribe(States.SPA,
+                                       lambda panel: calls.append('spa'))
+            unsubscribe()
+            await aq.connect_socket('127.0.0.1', port)
+            async for _ in aq.updates():
+                pass
+            server.close()
+            await server.wait_closed()
+            return calls
+
+        assert sorted(asyncio.run(run())) == ['pool', 'salt']
+
+    def test_state_change_retries(self):
+        received = bytearray()
+
+        async def handle(reader, writer):
+            for _ in range(30):
+                writer.write(KEEP_ALIVE)
+                await writer.drain()
+                await asyncio.sleep(0.005)
+            writer.close()
+            received.extend(await reader.read())
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            aq = AsyncAquaLogic()
+            aq.STATE_CHECK_DELAY = 0
+            await aq.connect_socket('127.0.0.1', port)
+            aq.send_key(Keys.MENU)
+            assert aq.set_state(States.LIGHTS, True)
+            # The pending request is reported until it is abandoned
+            assert aq.get_state(States.LIGHTS)
+            async for _ in aq.updates():
+                pass
+            server.close()
+            await server.wait_closed()
+            return aq
+
+        aq = asyncio.run(run())
+        assert not aq.get_state(States.LIGHTS)
+        # The LEDs never show the lights on, so the key is sent once and
+        # then retried until the retries run out.
+        frame = bytes(AquaLogic()._get_key_event_frame(Keys.LIGHTS))
+        assert received.count(frame) == 10
+
+
+class TestAquaLogicManager(object):
+    def test_panels(self):
+        async def run():
+            north = BusSimulator(PanelSimulator(rate=20))
+            south = BusSimulator(PanelSimulator(rate=20, is_metric=True))
+            south.panel.pool_temp = 27
+            changes = {}
+
+            def data_changed(name, panel, changed):
+                changes.setdefault(name, set()).update(changed)
+                if len(changes) == 2 and all(
+                        'pool_temp' in keys for keys in changes.values()):
+                    manager.close()
+
+            manager = AquaLogicManager(data_changed)
+            manager.add_socket_panel('north', *await north.start_tcp())
+            manager.add_socket_panel('south', *await south.start_tcp())
+            await asyncio.wait_for(manager.run(), 5)
+            await north.close()
+            await south.close()
+            return manager
+
+        manager = asyncio.run(run())
+        assert manager.names == ['north', 'south']
+        assert manager.panel('north').pool_temp == 80
+        assert not manager.panel('north').is_metric
+        assert manager.panel('south').pool_temp == 27
+        assert manager.panel('south').is_metric
+
+    def test_reconnect(self):
+        async def run():
+            bus = BusSimulator(PanelSimulator(rate=20))
+            host, port = await bus.start_tcp()
+            panels = []
+
+            def data_changed(name, panel, changed):
+                panels.append(panel)
+                if 'pool_temp' in changed:
+                    if manager.health('pool').connects == 1:
+                        # Drop the connection; the panel keeps its values
+                        asyncio.get_running_loop().create_task(restart())
+                    else:
+                        manager.close()
+
+            async def restart():
+                await bus.close()
+                bus.panel.pool_temp = 82
+                await bus.start_tcp(host, port)
+
+            manager = AquaLogicManager(data_changed)
+            manager.add_socket_panel('pool', host, port)
+            await asyncio.wait_for(manager.run(), 5)
+            await bus.close()
+            return manager, panels
+
+        manager, panels = asyncio.run(run())
+        panel = manager.panel('pool')
+        assert all(p is panel for p in panels)
+        assert panel.pool_temp == 82
+        assert panel.get_state(States.FILTER)
+        health = manager.health('pool')
+        assert health.connects == 2
+        assert health.disconnects == 1
+
+    def test_reconnect_echoes(self):
+        async def run():
+            bus = BusSimulator(PanelSimulator(rate=20))
+            host, port = await bus.start_tcp()
+            aq = AsyncAquaLogic(check_echo=True)
+            await aq.connect_socket(host, port)
+            # Sent just before the connection dropped
+            aq.send_key(Keys.MENU)
+            aq._send_frames()
+            aq._last_burst = True
+            await bus.close()
+            while aq.connected:
+                await asyncio.sleep(0.01)
+            return aq
+
+        aq = asyncio.run(run())
+        assert not aq._awaiting_echo
+        assert not aq._last_burst
+        assert aq.queue_depth == 0
+
+    def test_reconnect_delay(self):
+        manager = AquaLogicManager(None)
+        assert manager.reconnect_delay(1) == 0
+        for failures in range(2, 20):
+            limit = min(manager.RECONNECT_MAX_DELAY,
+                        manager.RECONNECT_MIN_DELAY * 2 ** (failures - 2))
+            assert limit / 2 <= manager.reconnect_delay(failures) <= limit
+        assert manager.reconnect_delay(100) <= manager.RECONNECT_MAX_DELAY
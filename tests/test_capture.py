@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.capture import (CaptureError, CaptureWriter, ReplayIO,
+                               read_capture)
+from aqualogic.core import AquaLogic
+from io import BytesIO, FileIO
+import pytest
+import time
+
+
+class TestCapture(object):
+    def data_changed(self, aq, changed):
+        pass
+
+    def test_round_trip(self):
+        f = BytesIO()
+        writer = CaptureWriter(f)
+        writer.write(b'\x10\x02', writer._start_time + 0.5)
+        writer.write(b'\x01\x01\x00\x14\x10\x03', writer._start_time + 1.0)
+        f.seek(0)
+        assert list(read_capture(f)) == [
+            (0.5, b'\x10\x02'), (1.0, b'\x01\x01\x00\x14\x10\x03')]
+
+    def test_not_a_capture(self):
+        with pytest.raises(CaptureError):
+            list(read_capture(BytesIO(b'\x10\x02\x01\x01\x00\x14\x10\x03')))
+
+    def test_record_and_replay(self, tmp_path):
+        path = str(tmp_path / 'pool_on.cap')
+        aq = AquaLogic()
+        aq.connect_io(FileIO('tests/data/pool_on.bin'))
+        with open(path, 'wb') as f:
+            aq.record(f)
+            aq.process(self.data_changed)
+            aq.stop_recording()
+
+        replayed = AquaLogic()
+        replayed.connect_replay(path)
+        replayed.process(self.data_changed)
+        assert replayed.air_temp == aq.air_temp == -6
+        assert replayed.salt_level == aq.salt_level == 3.1
+        assert replayed.states() == aq.states()
+
+    def test_realtime_replay(self):
+        f = BytesIO()
+        writer = CaptureWriter(f)
+        writer.write(b'a', writer._start_time)
+        writer.write(b'b', writer._start_time + 0.2)
+        f.seek(0)
+        replay = ReplayIO(f, realtime=True, speed=2.0)
+        start = time.monotonic()
+        assert replay.read(10) == b'a'
+        assert replay.read(10) == b'b'
+        assert replay.read(10) == b''
+        assert time.monotonic() - start >= 0.09
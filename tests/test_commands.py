@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.commands import CommandQueue, Priority
+
+
+class TestCommandQueue(object):
+    def test_priority(self):
+        commands = CommandQueue()
+        commands.put('menu', Priority.LOW)
+        commands.put('lights')
+        commands.put('aux_1', Priority.HIGH)
+        assert len(commands) == 3
+        assert [commands.get() for _ in range(4)] == [
+            'lights', 'aux_1', 'menu', None]
+        assert not commands
+
+    def test_remove(self):
+        commands = CommandQueue()
+        first, second = {'key': 1}, {'key': 1}
+        commands.put(first)
+        commands.put(second)
+        # Commands are matched by identity, not equality
+        assert commands.remove(second)
+        assert not commands.remove(second)
+        assert commands.get() is first
+        commands.put(first)
+        commands.clear()
+        assert len(commands) == 0
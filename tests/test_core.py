@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
 
-from aqualogic.core import AquaLogic, States
+from aqualogic.commands import Priority
+from aqualogic.core import AquaLogic, KeyEventSource, Keys, States
+from aqualogic.frame import FrameDecoder, encode_frame
+from aqualogic.simulator import PanelSimulator
 from io import FileIO
 import pytest
 import logging
 import socket
+import time
 
 logging.basicConfig(level=logging.DEBUG)
 
+KEEP_ALIVE = b'\x10\x02\x01\x01\x00\x14\x10\x03'
+
 class TestAquaLogic(object):
-    def data_changed(self, aq):
+    def data_changed(self, aq, changed):
         pass
 
     def test_pool(self):
@@ -43,3 +49,281 @@ class TestAquaLogic(object):
         assert not aq.get_state(States.POOL)
         assert aq.get_state(States.FILTER)
         assert aq.get_state(States.SPA)
+
+    def test_frame_handlers(self):
+        leds = (States.POOL.value | States.FILTER.value).to_bytes(
+            4, byteorder='little') + bytes(4)
+
+        aq = AquaLogic()
+        aq._process_frame(AquaLogic.FRAME_TYPE_LEDS, leds, 0,
+                          self.data_changed)
+        assert aq.get_state(States.POOL)
+        assert aq.get_state(States.FILTER)
+
+        aq = AquaLogic()
+        keep_alives = []
+        unknown = []
+        aq.register_frame_handler(AquaLogic.FRAME_TYPE_KEEP_ALIVE,
+                                  lambda frame_type, frame:
+                                  keep_alives.append(frame))
+        aq.register_frame_handler(0x0102, lambda frame_type, frame: None)
+        aq.register_frame_handler(None, lambda frame_type, frame:
+                                  unknown.append(frame_type))
+        for frame_type, frame in ((AquaLogic.FRAME_TYPE_KEEP_ALIVE, b''),
+                                  (AquaLogic.FRAME_TYPE_LEDS, leds),
+                                  (b'\x04\x07', b'\x00')):
+            aq._process_frame(frame_type, frame, 0, self.data_changed)
+        assert keep_alives == [b'']
+        assert unknown == [b'\x04\x07']
+        # The LEDs handler was replaced
+        assert not aq.get_state(States.POOL)
+
+    def test_frame_timeout(self):
+        class Noise(object):
+            reads = 0
+
+            def read(self, size):
+                self.reads += 1
+                return b'\x10\x00\x55' * 100
+
+        aq = AquaLogic()
+        aq.READ_TIMEOUT = 0
+        noise = Noise()
+        aq.connect_io(noise)
+        aq.process(self.data_changed)
+        assert noise.reads == 1
+        assert aq.frame_time is None
+
+    def test_frame_time(self):
+        aq = AquaLogic()
+        aq.connect_io(FileIO('tests/data/pool_on.bin'))
+        latencies = []
+        aq.process(lambda panel, changed:
+                   latencies.append(time.monotonic() - panel.frame_time))
+        assert latencies and all(latency >= 0 for latency in latencies)
+
+    def test_key_event_sources(self):
+        decoder = FrameDecoder()
+        aq = AquaLogic()
+        assert aq.key_event_source == KeyEventSource.LOCAL_WIRED
+        assert decoder.feed(aq._get_key_event_frame(Keys.LIGHTS)) == [
+            (b'\x00\x02', b'\x00\x01\x00\x01')]
+        # Wireless-only keys are always sent as wireless key events
+        assert decoder.feed(aq._get_key_event_frame(Keys.AUX_8)) == [
+            (b'\x00\x83', b'\x01\x00\x00\x08\x00\x00\x00\x08\x00\x00')]
+
+        aq = AquaLogic(key_event_source=KeyEventSource.REMOTE_WIRED)
+        assert decoder.feed(aq._get_key_event_frame(Keys.LIGHTS)) == [
+            (b'\x00\x03', b'\x00\x01\x00\x01')]
+        aq.key_event_source = KeyEventSource.WIRELESS
+        assert decoder.feed(aq._get_key_event_frame(Keys.LIGHTS)) == [
+            (b'\x00\x83', b'\x01\x00\x01\x00\x00\x00\x01\x00\x00\x00')]
+        assert decoder.bad_frames == 0
+
+    def test_command_queue(self):
+        class Bus(object):
+            def __init__(self):
+                self.written = []
+
+            def read(self, size):
+                return KEEP_ALIVE * 3
+
+            def write(self, data):
+                self.written.append(bytes(data))
+
+            def flush(self):
+                pass
+
+        aq = AquaLogic()
+        bus = Bus()
+        aq.connect_io(bus)
+        aq.send_key(Keys.MENU, Priority.LOW)
+        assert aq.set_state(States.LIGHTS, True)
+        assert aq.set_state(States.AUX_1, True)
+        # Turning the lights back off cancels the queued change
+        assert aq.set_state(States.LIGHTS, False)
+        assert not aq.get_state(States.LIGHTS)
+        # A duplicate request is already satisfied by the pending one
+        assert aq.set_state(States.AUX_1, True)
+        assert aq.queue_depth == 2
+        assert aq.queue_drain_time == 2 * AquaLogic.KEEP_ALIVE_INTERVAL
+
+        # One command is sent per keep-alive, user commands first
+        for frame_type, frame in aq._decoder.feed(bus.read(0)):
+            aq._process_frame(frame_type, frame, 0, self.data_changed)
+        assert bus.written == [aq._get_key_event_frame(Keys.AUX_1),
+                               aq._get_key_event_frame(Keys.MENU)]
+        assert aq.queue_depth == 0
+        assert aq.get_state(States.AUX_1)
+
+    def test_reversed_state_change(self):
+        panel = PanelSimulator()
+        aq = AquaLogic()
+        aq.STATE_CHECK_DELAY = 0.05
+        written = []
+        aq._write = written.append
+        sent = []
+
+        def keep_alive():
+            for frame_type, frame in aq._decoder.feed(KEEP_ALIVE):
+                aq._process_frame(frame_type, frame, 0, self.data_changed)
+            sent.extend(written)
+            response = panel.receive(b''.join(written))
+            written.clear()
+            for frame_type, frame in aq._decoder.feed(response):
+                aq._process_frame(frame_type, frame, 0, self.data_changed)
+
+        # The lights are turned back off after the first key was sent
+        assert aq.set_state(States.LIGHTS, True)
+        keep_alive()
+        assert aq.set_state(States.LIGHTS, False)
+        keep_alive()
+        time.sleep(0.06)
+        for _ in range(3):
+            keep_alive()
+        assert len(sent) == 2
+        assert not panel.states & States.LIGHTS
+        assert not aq.get_state(States.LIGHTS)
+        assert aq.queue_depth == 0
+        assert not aq._pending_states
+
+    def _run_windows(self, aq, windows, echo):
+        """Feeds keep-alives 0.1 s apart, echoing whatever the panel
+        writes back to it if echo is set. Returns the number of frames
+        written in each keep-alive window."""
+        written = []
+        aq._write = written.append
+        sent = []
+        for window in range(windows):
+            for frame_type, frame in aq._decoder.feed(KEEP_ALIVE):
+                aq._process_frame(frame_type, frame, window * 0.1,
+                                  self.data_changed)
+            sent.append(len(written))
+            if echo:
+                for frame_type, frame in aq._decoder.feed(b''.join(written)):
+                    aq._process_frame(frame_type, frame, window * 0.1,
+                                      self.data_changed)
+            written.clear()
+        return sent
+
+    def test_burst(self):
+        aux = [States.AUX_1, States.AUX_2, States.AUX_3, States.AUX_4,
+               States.AUX_5, States.AUX_6]
+        aq = AquaLogic(max_burst=8)
+        for state in aux:
+            aq.set_state(state, True)
+        assert aq.queue_drain_time == pytest.approx(aq.KEEP_ALIVE_INTERVAL)
+        assert self._run_windows(aq, 2, echo=False) == [6, 0]
+
+        # With echo checking the burst starts at one frame and grows while
+        # the echoes come back
+        aq = AquaLogic(max_burst=8, check_echo=True)
+        for state in aux:
+            aq.set_state(state, True)
+        assert aq.queue_drain_time == pytest.approx(
+            6 * aq.KEEP_ALIVE_INTERVAL)
+        assert self._run_windows(aq, 4, echo=True) == [1, 2, 3, 0]
+        assert aq.collisions == 0
+
+    def test_burst_window(self):
+        aq = AquaLogic(max_burst=8)
+        aq.BURST_WINDOW = 0.2
+        for _ in range(8):
+            aq.send_key(Keys.MENU)
+        # 20 ms of a 100 ms keep-alive interval fits two 12 byte frames
+        assert self._run_windows(aq, 4, echo=False) == [2, 2, 2, 2]
+
+    def test_missing_echo(self):
+        aq = AquaLogic(max_burst=8, check_echo=True)
+        aq.send_key(Keys.MENU)
+        assert aq.set_state(States.LIGHTS, True)
+        # The key is resent until ECHO_RETRIES run out; the state change
+        # is left to its verification.
+        assert self._run_windows(aq, 6, echo=False) == [1, 1, 1, 1, 1, 0]
+        assert aq.collisions == 5
+
+    def test_history(self):
+        aq = AquaLogic()
+        aq.connect_io(FileIO('tests/data/pool_on.bin'))
+        start = time.time()
+        aq.process(self.data_changed)
+        air_temps = aq.history('air_temp')
+        assert air_temps and all(value == -6 for _, value in air_temps)
+        assert air_temps[0][0] >= start
+        assert aq.history('air_temp', since=time.time() + 1) == []
+        assert aq.history('spa_temp') == []
+        with pytest.raises(ValueError):
+            aq.history('status')
+        assert AquaLogic(history=False).history('air_temp') == []
+
+    def test_pump_energy(self):
+        panel = PanelSimulator()
+        aq = AquaLogic()
+        for t in range(0, 3602, 2):
+            for frame_type, frame in aq._decoder.feed(panel.pump_frames()):
+                aq._process_frame(frame_type, frame, t,
+                                  lambda aq, changed=(): None)
+        # 1250 W for an hour at 75%
+        assert aq.pump_energy_kwh == 1.25
+        assert list(aq.pump_energy()) == [70]
+        assert round(aq.pump_energy()[70], 6) == 1.25
+
+    def test_display_text_changes(self):
+        aq = AquaLogic()
+        texts = []
+        aq.subscribe('display_text', lambda panel: texts.append(
+            panel.display_text))
+        changes = []
+        aq.connect_io(FileIO('tests/data/pool_on.bin'))
+        aq.process(lambda panel, changed: changes.append(changed))
+        # Only subscribers hear about the display rotating
+        assert len(texts) > len(changes)
+        assert texts[-1] == aq.display_text
+        assert not any('display_text' in changed for changed in changes)
+        assert not hasattr(aq.snapshot(), 'display_text')
+
+    def test_long_display(self):
+        aq = AquaLogic()
+        aq.connect_io(FileIO('tests/data/settings_menu.bin'))
+        aq.process(self.data_changed)
+        assert aq.display_text == '    Settings          Menu'
+        assert aq.pool_heater_setpoint is None
+
+        frame = encode_frame(AquaLogic.FRAME_TYPE_LONG_DISPLAY_UPDATE,
+                             b'Spa Heater1         102\xdfF       \x00')
+        for frame_type, frame in aq._decoder.feed(frame):
+            aq._process_frame(frame_type, frame, 0, self.data_changed)
+        assert aq.spa_heater_setpoint == 102
+        assert aq.display_text == 'Spa Heater1         102\xb0F'
+
+    def test_snapshot(self):
+        aq = AquaLogic()
+        empty = aq.snapshot()
+        assert empty.pool_temp is None
+        assert empty.states == frozenset()
+
+        snapshots = []
+        aq.connect_io(FileIO('tests/data/pool_on.bin'))
+        aq.process(lambda panel, changed: snapshots.append(panel.snapshot()))
+        snapshot = aq.snapshot()
+        assert snapshots[-1] is snapshot
+        assert snapshot.is_metric
+        assert snapshot.air_temp == -6
+        assert snapshot.pool_temp == -7
+        assert snapshot.salt_level == 3.1
+        assert snapshot.status == 'OK'
+        assert snapshot.get_state(States.POOL)
+        assert snapshot.states == aq.states()
+        assert snapshot.time is not None
+        # Earlier snapshots keep their values
+        assert empty.pool_temp is None
+        assert snapshots[0].salt_level is None
+        with pytest.raises(AttributeError):
+            snapshot.pool_temp = 20
+        with pytest.raises(AttributeError):
+            snapshot.extra = 1
+
+        # Frames that change nothing don't replace the snapshot
+        for frame_type, frame in aq._decoder.feed(KEEP_ALIVE):
+            aq._process_frame(frame_type, frame, 0, self.data_changed)
+        assert aq.snapshot() is snapshot
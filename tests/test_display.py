@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.display import (DisplayParser, display_frame_text,
+                               parse_display_text)
+
+
+class TestDisplay(object):
+    def test_temperature(self):
+        assert parse_display_text('Pool Temp  -7\xdfC                 ') == (
+            ('pool_temp', -7), ('is_metric', True))
+        assert parse_display_text(' Spa Temp  84\xdfF') == (
+            ('spa_temp', 84), ('is_metric', False))
+
+    def test_salt_level(self):
+        assert parse_display_text('   Salt Level       3.1 g/L     ') == (
+            ('salt_level', 3.1), ('is_metric', True))
+
+    def test_chlorinator(self):
+        assert parse_display_text('Spa Chlorinator        3%       ') == (
+            ('spa_chlorinator', 3),)
+
+    def test_heater(self):
+        assert parse_display_text('    Heater1       Auto Control  ') == (
+            ('heater_auto_mode', True),)
+        assert parse_display_text('Gas Heater Manual Off') == (
+            ('heater_auto_mode', False), ('heater_enabled', False))
+        assert parse_display_text('Gas Heater Something Else') == ()
+
+    def test_unparsed(self):
+        assert parse_display_text('   Wednesday          2:24P     ') == ()
+        assert parse_display_text('Pool Chlorinator                ') == ()
+        assert parse_display_text('') == ()
+
+    def test_cache(self):
+        parser = DisplayParser()
+        frame = b'Air Temp   -6\xdfC                 \x00'
+        result = parser.parse(frame)
+        assert result == (('display_text', 'Air Temp   -6\xb0C'),
+                          ('air_temp', -6), ('is_metric', True))
+        assert parser.parse(frame) is result
+
+    def test_heater_setpoint(self):
+        assert parse_display_text('Pool Heater1         84\xb0F       ') == (
+            ('pool_heater_setpoint', 84), ('is_metric', False))
+        assert parse_display_text(' Spa Heater1          Off       ') == (
+            ('spa_heater_setpoint', None),)
+        # Blanked while the setpoint is being edited
+        assert parse_display_text('Pool Heater1                    ') == ()
+
+    def test_display_frame_text(self):
+        assert display_frame_text(
+            b'     Beeper         Enabled     \x09') == (
+                '     Beeper         Enabled')
+        assert display_frame_text(b'Pool Temp  80\xdfF\x00\x05') == (
+            'Pool Temp  80\xb0F')
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.energy import EnergyMeter
+import datetime
+
+DAY = datetime.date(2024, 6, 1)
+
+
+class TestEnergyMeter(object):
+    def test_bands(self):
+        meter = EnergyMeter()
+        # An hour at 1000 W at 75%, then an hour at 200 W at 40%
+        for t in range(0, 3600, 2):
+            meter.add(t, 1000, 75, DAY)
+        for t in range(3600, 7202, 2):
+            meter.add(t, 200, 40, DAY)
+        wh = meter.wh(DAY)
+        # The interval spanning the speed change is averaged and counted
+        # at the old speed
+        assert round(wh[70], 3) == round(1000 - 2 * 1000 / 3600 + 600 / 1800, 3)
+        assert round(wh[40], 3) == 200
+        assert round(meter.day_wh(DAY), 3) == round(meter.total_wh, 3)
+
+    def test_gaps(self):
+        meter = EnergyMeter()
+        meter.add(0, 3600, 100, DAY)
+        meter.add(1, 3600, 100, DAY)
+        # Connection lost for a minute
+        meter.add(61, 3600, 100, DAY)
+        meter.add(62, 3600, 100, DAY)
+        assert meter.wh(DAY) == {100: 2.0}
+
+    def test_rollover(self):
+        meter = EnergyMeter()
+        meter.DAYS = 2
+        next_day = DAY + datetime.timedelta(days=1)
+        meter.add(0, 3600, 50, DAY)
+        meter.add(1, 3600, 50, next_day)
+        assert meter.wh(DAY) == {50: 1.0}
+        assert meter.wh(next_day) == {}
+        meter.add(2, 3600, 50, next_day)
+        assert meter.wh(next_day) == {50: 1.0}
+        meter.add(3, 3600, 50, next_day + datetime.timedelta(days=1))
+        assert meter.days == [next_day, next_day + datetime.timedelta(days=1)]
+        assert meter.wh(DAY) == {}
+        assert meter.total_wh == 3.0
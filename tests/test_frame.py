@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.frame import (FRAME_END, FRAME_START, FrameDecoder,
+                             checksum, encode_frame, stuff, unstuff)
+import random
+
+KEEP_ALIVE = b'\x10\x02\x01\x01\x00\x14\x10\x03'
+# LEDs frame with a DLE in the payload, followed by the stuffed NUL
+LEDS = (b'\x10\x02\x01\x02\x10\x00' + bytes(7) +
+        b'\x00\x25\x10\x03')
+
+
+class TestFrameDecoder(object):
+    def test_keep_alive(self):
+        decoder = FrameDecoder()
+        assert decoder.feed(KEEP_ALIVE) == [(b'\x01\x01', b'')]
+
+    def test_unstuffing(self):
+        decoder = FrameDecoder()
+        assert decoder.feed(LEDS) == [(b'\x01\x02', b'\x10' + bytes(7))]
+
+    def test_partial_frames(self):
+        decoder = FrameDecoder()
+        data = b'\x00\xff' + KEEP_ALIVE + LEDS + KEEP_ALIVE
+        frames = []
+        for i in range(len(data)):
+            frames += decoder.feed(data[i:i + 1])
+        assert [frame_type for frame_type, _ in frames] == [
+            b'\x01\x01', b'\x01\x02', b'\x01\x01']
+
+    def test_bad_crc(self):
+        decoder = FrameDecoder()
+        assert decoder.feed(KEEP_ALIVE[:5] + b'\x15' + KEEP_ALIVE[6:]) == []
+        assert decoder.bad_frames == 1
+
+    def test_resync_after_truncated_frame(self):
+        decoder = FrameDecoder()
+        assert decoder.feed(LEDS[:8] + KEEP_ALIVE) == [(b'\x01\x01', b'')]
+
+
+class TestFrameHelpers(object):
+    def test_checksum(self):
+        assert checksum(b'\x01\x01') == 0x14
+        assert checksum(b'\xff' * 300) == (0x12 + 0xff * 300) & 0xffff
+
+    def test_stuffing(self):
+        assert stuff(b'\x01\x10\x10\x00') == b'\x01\x10\x00\x10\x00\x00'
+        assert unstuff(b'\x01\x10\x00\x10\x00\x00') == b'\x01\x10\x10\x00'
+
+    def test_round_trip(self):
+        # Random payloads weighted towards the framing bytes
+        rng = random.Random(1234)
+        alphabet = [0x00, 0x02, 0x03, 0x10, 0xff] + list(range(256))
+        decoder = FrameDecoder()
+        for _ in range(500):
+            frame_type = bytes(rng.choice(alphabet) for _ in range(2))
+            payload = bytes(rng.choice(alphabet)
+                            for _ in range(rng.randint(0, 61)))
+            assert unstuff(stuff(payload)) == payload
+            encoded = encode_frame(frame_type, payload)
+            assert FRAME_START not in encoded[2:]
+            assert FRAME_END not in encoded[:-2]
+            assert decoder.feed(encoded) == [(frame_type, payload)]
+        assert decoder.bad_frames == 0
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.history import FieldHistory, RingBuffer
+
+
+class TestRingBuffer(object):
+    def test_wrap(self):
+        buffer = RingBuffer(3)
+        assert buffer.items() == []
+        assert buffer.oldest() is None
+        for i in range(5):
+            buffer.append(i, i * 10)
+        assert len(buffer) == 3
+        assert buffer.overwritten
+        assert buffer.oldest() == 2
+        assert buffer.items() == [(2, 20), (3, 30), (4, 40)]
+        assert buffer.items(since=3) == [(3, 30), (4, 40)]
+        assert buffer.items(since=5) == []
+
+
+class TestFieldHistory(object):
+    def test_tiers(self):
+        history = FieldHistory()
+        start = 1700000000 - 1700000000 % 3600
+        # One reading every 10 s for two hours; the value is the minute
+        for t in range(0, 7200, 10):
+            history.add(start + t, t // 60)
+
+        # The last 720 readings cover the whole two hours
+        assert len(history.items()) == 720
+        assert history.items(start + 7190) == [(start + 7190, 119)]
+
+        minutes = history.items(start + 3600, resolution=60)
+        assert len(minutes) == 60
+        assert minutes[0] == (start + 3600, 60)
+        assert minutes[-1] == (start + 7140, 119)
+
+        hours = history.items(resolution=3600)
+        assert hours == [(start, 29.5), (start + 3600, 89.5)]
+
+    def test_fallback_to_coarser_tier(self):
+        history = FieldHistory()
+        start = 1700000000 - 1700000000 % 3600
+        for t in range(0, 7200, 5):
+            history.add(start + t, 1.0)
+        # The readings only reach back an hour, so older data comes from
+        # the minute averages
+        assert history.items(start + 3600)[0] == (start + 3600, 1.0)
+        items = history.items(start)
+        assert len(items) == 60 + 720
+        assert items[:2] == [(start, 1.0), (start + 60, 1.0)]
+        assert items[59:62] == [(start + 3540, 1.0), (start + 3600, 1.0),
+                                (start + 3605, 1.0)]
+        assert history.items() == items
+        assert len(history.items(resolution=60)) == 120
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.aio import AsyncAquaLogic
+from aqualogic.commands import CommandQueue
+from aqualogic.core import Keys
+from aqualogic.menu import Menu, MenuError, display_title, display_value
+from aqualogic.simulator import BusSimulator, PanelSimulator
+import asyncio
+import pytest
+
+
+async def _connect(panel):
+    bus = BusSimulator(panel)
+    host, port = await bus.start_tcp()
+    aq = AsyncAquaLogic(max_burst=4)
+    await aq.connect_socket(host, port)
+    return bus, aq
+
+
+class _Panel(object):
+    """Queues keys without sending them."""
+
+    def __init__(self):
+        self.queue = CommandQueue()
+        self.display_text = ''
+        self._callback = None
+
+    def subscribe(self, key, callback):
+        self._callback = callback
+
+    def send_key(self, key, priority):
+        request = {'key': key}
+        self.queue.put(request, priority)
+        return request
+
+    def cancel_key(self, request):
+        return self.queue.remove(request)
+
+    def show(self, text):
+        self.display_text = text
+        self._callback(self)
+
+
+class TestMenu(object):
+    def test_display_lines(self):
+        text = 'Pool Chlorinator       0%   Off'
+        assert display_title(text) == 'Pool Chlorinator'
+        assert display_value(text) == '0% Off'
+        assert display_value('    Settings          Menu') == 'Menu'
+
+    def test_set_setpoints(self):
+        async def run():
+            panel = PanelSimulator(rate=20)
+            panel.pool_heater_setpoint = 80
+            bus, aq = await _connect(panel)
+            await aq.menu.set_pool_setpoint(84)
+            await aq.menu.set_spa_setpoint(66)
+            await aq.menu.set_pool_chlorinator(35)
+            await aq.menu.set_pool_setpoint(None)
+            aq.close()
+            await bus.close()
+            return panel, aq
+
+        panel, aq = asyncio.run(run())
+        assert panel.pool_heater_setpoint is None
+        assert panel.spa_heater_setpoint == 66
+        assert panel.pool_chlorinator_output == 35
+        assert aq.spa_heater_setpoint == 66
+
+    def test_read_all_settings(self):
+        async def run():
+            panel = PanelSimulator(rate=20, is_metric=True)
+            panel.spa_heater_setpoint = 38
+            bus, aq = await _connect(panel)
+            settings = await aq.menu.read_all_settings()
+            pool = await aq.menu.read_setting('Pool Chlorinator')
+            aq.close()
+            await bus.close()
+            return settings, pool, aq
+
+        settings, pool, aq = asyncio.run(run())
+        assert settings == {'Spa Heater1': '38\xb0C', 'Pool Heater1': 'Off',
+                            'Spa Chlorinator': '0%',
+                            'Pool Chlorinator': '50%'}
+        assert pool == '50%'
+        assert aq.spa_heater_setpoint == 38
+
+    def test_errors(self):
+        async def run():
+            bus, aq = await _connect(PanelSimulator(rate=20))
+            aq.menu.KEY_TIMEOUT = 0.1
+            with pytest.raises(MenuError, match='not found'):
+                await aq.menu.read_setting('Pool Heater2')
+            # The panel stops responding to keys
+            bus.panel.press = lambda key: b''
+            with pytest.raises(MenuError, match='No response'):
+                await aq.menu.set_pool_chlorinator(10)
+            aq.close()
+            await bus.close()
+
+        asyncio.run(run())
+
+    def test_unreachable_value(self):
+        async def run():
+            bus, aq = await _connect(PanelSimulator(rate=20))
+            presses = []
+            press = bus.panel.press
+
+            def count(key):
+                presses.append(key)
+                return press(key)
+
+            bus.panel.press = count
+            await aq.menu.read_setting('Pool Chlorinator')
+            presses.clear()
+            # The chlorinator output steps by 5%
+            with pytest.raises(MenuError, match='can not be set to 33'):
+                await aq.menu.set_pool_chlorinator(33)
+            aq.close()
+            await bus.close()
+            return bus.panel, presses
+
+        panel, presses = asyncio.run(run())
+        assert panel.pool_chlorinator_output == 30
+        assert len(presses) == 4
+
+    def test_press_once(self):
+        async def run():
+            panel = _Panel()
+            menu = Menu(panel)
+            menu.KEY_TIMEOUT = 0.05
+            menu.KEY_RETRIES = 5
+            task = asyncio.get_running_loop().create_task(
+                menu.press(Keys.RIGHT, lambda text: text == 'next'))
+            # Queued behind other commands past two timeouts
+            await asyncio.sleep(0.125)
+            assert len(panel.queue) == 1
+            assert panel.queue.get()['key'] == Keys.RIGHT
+            # Sent, but the display is slow to change
+            await asyncio.sleep(0.05)
+            assert len(panel.queue) == 0
+            panel.show('next')
+            assert await task == 'next'
+
+            # A key that is never sent is removed on giving up
+            menu.KEY_RETRIES = 1
+            with pytest.raises(MenuError, match='No response'):
+                await menu.press(Keys.RIGHT, lambda text: False)
+            assert len(panel.queue) == 0
+
+        asyncio.run(run())
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from aqualogic.aio import AsyncAquaLogic
+from aqualogic.core import AquaLogic, Keys, States
+from aqualogic.frame import FrameDecoder
+from aqualogic.simulator import BusSimulator, PanelSimulator
+import asyncio
+import serial
+
+
+async def _wait_for(condition, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, 'timed out'
+        await asyncio.sleep(0.01)
+
+
+class TestPanelSimulator(object):
+    def test_frames(self):
+        panel = PanelSimulator()
+        aq = AquaLogic()
+        frames = FrameDecoder().feed(panel.tick(0) + panel.tick(0.1))
+        for frame_type, frame in frames:
+            aq._process_frame(frame_type, frame, 0,
+                              lambda panel, changed: None)
+        assert aq.pool_temp == 80
+        assert aq.pump_speed == 75
+        assert aq.pump_power == 1250
+        assert aq.get_state(States.POOL)
+        assert frames.count((AquaLogic.FRAME_TYPE_KEEP_ALIVE, b'')) == 2
+
+    def test_key_events(self):
+        panel = PanelSimulator()
+        aq = AquaLogic()
+        panel.receive(aq._get_key_event_frame(Keys.LIGHTS))
+        assert panel.states & States.LIGHTS
+        panel.receive(aq._get_key_event_frame(Keys.AUX_8))
+        assert panel.states & States.AUX_8
+        panel.receive(aq._get_key_event_frame(Keys.POOL_SPA))
+        assert panel.states & States.SPA
+        assert not panel.states & States.POOL
+
+    def test_filter_speeds(self):
+        panel = PanelSimulator()
+        panel.press(Keys.FILTER)
+        assert panel.flashing_states & States.FILTER
+        panel.press(Keys.FILTER)
+        assert not panel.states & States.FILTER
+        panel.press(Keys.FILTER)
+        assert panel.states & States.FILTER
+
+
+class TestBusSimulator(object):
+    def test_tcp(self):
+        async def run():
+            bus = BusSimulator(PanelSimulator(rate=20))
+            host, port = await bus.start_tcp()
+            aq = AsyncAquaLogic()
+            await aq.connect_socket(host, port)
+            await _wait_for(lambda: aq.pool_temp is not None)
+            assert aq.set_state(States.LIGHTS, True)
+            await _wait_for(lambda: aq._get_actual_state(States.LIGHTS))
+            aq.close()
+            await bus.close()
+            return aq
+
+        aq = asyncio.run(run())
+        assert aq.get_state(States.LIGHTS)
+
+    def test_pty(self):
+        async def run():
+            bus = BusSimulator(PanelSimulator(rate=20))
+            path = bus.start_pty()
+            port = serial.Serial(path, timeout=1)
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(None, port.read, 64)
+            port.close()
+            await bus.close()
+            return data
+
+        frames = FrameDecoder().feed(asyncio.run(run()))
+        assert (AquaLogic.FRAME_TYPE_KEEP_ALIVE, b'') in frames